@@ -0,0 +1,181 @@
+"""Adaptive scheduling of tempo analysis."""
+import numpy as np
+
+from PySide2.QtCore import QObject, Signal, Slot
+
+from instrumentation import metrics
+
+class NoveltyDetector():
+    """Detect sudden changes in the spectral envelope of audio.
+
+    Newest audio is reduced to log energies in a few logarithmic frequency
+    bands, which are compared to a slowly updated average. A large distance
+    means a new song, or music starting after silence.
+    """
+    block_size = 4096
+    max_blocks = 8
+    band_count = 8
+    threshold = 1.5
+    adaptation = 0.3
+
+    def __init__(self, sample_rate):
+        frequencies = np.fft.rfftfreq(self.block_size, 1.0 / sample_rate)
+        edges = np.geomspace(60.0, sample_rate / 2.0, self.band_count + 1)
+        self._bands = np.searchsorted(edges, frequencies) - 1
+        self._bands[(self._bands < 0) | (self._bands >= self.band_count)] = -1
+        self._window = np.hanning(self.block_size).astype(np.float32)
+        self._average = None
+
+    def reset(self):
+        self._average = None
+
+    def update(self, audio):
+        """Return True if audio differs clearly from the audio before it."""
+        block_count = min(len(audio) // self.block_size, self.max_blocks)
+        if block_count == 0:
+            return False
+        blocks = audio[len(audio) - block_count * self.block_size:]
+        blocks = blocks.reshape(block_count, self.block_size) * self._window
+        power = (np.abs(np.fft.rfft(blocks, axis=1)) ** 2).mean(axis=0)
+        used = self._bands >= 0
+        energies = np.log10(np.bincount(self._bands[used], weights=power[used],
+                                        minlength=self.band_count) + 1e-9)
+
+        if self._average is None:
+            self._average = energies
+            return False
+        distance = float(np.sqrt(np.mean((energies - self._average) ** 2)))
+        self._average += self.adaptation * (energies - self._average)
+        return distance > self.threshold
+
+class AnalysisScheduler(QObject):
+    """Adapt analysis interval and window length to the music.
+
+    After a track change or detected novelty, audio is analysed with short
+    windows at fast_interval_ms for a few windows to find the new tempo
+    quickly. After that, full windows are analysed at interval_ms. When
+    stable_estimates estimates in a row agree, the interval is doubled up to
+    max_interval_ms, and any disagreeing estimate brings it back to interval_ms.
+    When tempo is already known, for example from the tempo cache, audio is
+    only analysed every verification_interval_ms.
+
+    If adaptive is False, full windows are always analysed at interval_ms
+    except when verifying a known tempo.
+
+    Emits fast_started when new music is expected, also when not adaptive.
+
+    Parameters:
+        audio (AudioDevice): Audio device whose pull interval is controlled.
+        backend (BPMQt or BPMmp): Backend whose window size is controlled.
+    """
+    fast_windows = 4
+    fast_window_seconds = 3.5
+    stable_estimates = 3
+    tolerance = 0.03
+
+    fast_started = Signal()
+
+    def __init__(self, audio, backend, interval_ms, max_interval_ms,
+                 verification_interval_ms, fast_interval_ms=1000, adaptive=True):
+        super().__init__()
+        self.audio = audio
+        self.backend = backend
+        self.adaptive = adaptive
+        self.interval_ms = interval_ms
+        self.max_interval_ms = max_interval_ms
+        self.verification_interval_ms = verification_interval_ms
+        self.fast_interval_ms = fast_interval_ms
+        self.window_size = backend.window_size
+        self.fast_window_size = min(
+            int(self.fast_window_seconds * audio.ring_buffer.sample_rate),
+            self.window_size)
+        self.novelty = NoveltyDetector(audio.ring_buffer.sample_rate)
+
+        self.mode = "normal"
+        self.current_interval_ms = interval_ms
+        self._fast_left = 0
+        self._previous_bpm = None
+        self._agreeing = 0
+        self._last_end = None
+
+    def _set(self, mode, interval_ms, window_size):
+        self.mode = mode
+        self.current_interval_ms = interval_ms
+        self.audio.set_pull_interval(interval_ms)
+        self.backend.window_size = window_size
+        metrics.set_gauge("analysis_interval_ms", interval_ms)
+
+    def start_fast(self):
+        """Find tempo of new music quickly."""
+        self.fast_started.emit()
+        if not self.adaptive:
+            self.start_normal()
+            return
+        metrics.count("fast_analysis_started")
+        self._fast_left = self.fast_windows
+        self._previous_bpm = None
+        self._agreeing = 0
+        self._set("fast", self.fast_interval_ms, self.fast_window_size)
+
+    def start_normal(self):
+        self._agreeing = 0
+        self._set("normal", self.interval_ms, self.window_size)
+
+    def verify_only(self):
+        """Analyse rarely, when tempo is already known."""
+        self._set("verify", self.verification_interval_ms, self.window_size)
+
+    @Slot(str)
+    def track_changed(self, track_id):
+        self.novelty.reset()
+        self.start_fast()
+
+    @Slot(str)
+    def source_changed(self, name):
+        """Find tempo of another audio source quickly."""
+        self._last_end = None
+        self.novelty.reset()
+        self.start_fast()
+
+    @Slot(int)
+    def audio_ready(self, end):
+        """Check new audio for novelty before it is analysed."""
+        if not self.adaptive:
+            return
+        ring_buffer = self.audio.ring_buffer
+        new_samples = ring_buffer.capacity
+        if self._last_end is not None:
+            new_samples = min(end - self._last_end, new_samples)
+        self._last_end = end
+        if self.novelty.update(ring_buffer.window(new_samples, end)):
+            metrics.count("novelty_detected")
+            if self.mode != "fast":
+                self.start_fast()
+            return
+
+        if self.mode == "fast":
+            self._fast_left -= 1
+            if self._fast_left < 0:
+                self.start_normal()
+
+    def estimate(self, bpm):
+        """Update tempo stability with a new estimate."""
+        if not self.adaptive:
+            return
+        if self._previous_bpm is not None and \
+                abs(bpm - self._previous_bpm) <= self.tolerance * bpm:
+            self._agreeing += 1
+        else:
+            self._agreeing = 0
+        self._previous_bpm = bpm
+
+        if self.mode == "fast":
+            if self._agreeing >= 1:
+                self.start_normal()
+        elif self.mode == "normal" or self.mode == "backoff":
+            if self._agreeing >= self.stable_estimates - 1:
+                interval = min(2 * self.current_interval_ms,
+                               self.max_interval_ms)
+                self._set("backoff", interval, self.window_size)
+            elif self.mode == "backoff" and self._agreeing == 0:
+                self.start_normal()
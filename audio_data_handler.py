@@ -1,27 +1,65 @@
 import numpy as np
-assert np
 
 from PySide2.QtCore import Signal, Slot, QIODevice, QByteArray
+from PySide2.QtMultimedia import QAudioFormat
+
+from audio_gate import AudioGate
+from decimator import Decimator
+from instrumentation import metrics
 
 class AudioDataHandler(QIODevice):
-    """Class for storing incoming audio data in a buffer for later analysis.
+    """Class for storing incoming audio data in a ring buffer for later analysis.
 
     _buffer_size determines how much audio data is used when trying to find
     beats per minute (BPM) value. The value set has been found experimentally
     to give accurate BPM values without too much delay when BPM changes.
 
-    With current settings (44100Hz, 8bit uint), the buffe fills with 44100B/s.
-    Therefore, buffer of 350000 holds a bit more than 7 seconds of audio data.
+    _buffer_size is given in samples at 44100Hz. Therefore, buffer of 350000
+    holds a bit more than 7 seconds of audio data. The actual window size in
+    samples is scaled with the analysis sample rate.
+
+    Incoming PCM data is converted once to float32 between -1 and 1. If
+    analysis sample rate is lower than the capture sample rate, audio is
+    decimated with an anti-alias filter before it is written to the ring
+    buffer. Analysers read windows directly from the ring buffer, so only the
+    write index is passed around.
+
+    If silence_threshold_db is given, an AudioGate suppresses data_ready for
+    silent or unchanged audio, so nothing is analysed while music is not
+    playing.
     """
-    data_ready = Signal(np.ndarray)
+    data_ready = Signal(int)
     _buffer_size = 350000
+    _buffer_sample_rate = 44100
 
-    def __init__(self, format_):
+    def __init__(self, format_, ring_buffer, sample_rate=None,
+                 silence_threshold_db=None):
         super().__init__()
 
-        self._buffer = QByteArray()
         self._format = format_
-        self.data = None
+        self._ring_buffer = ring_buffer
+        self._channels = max(format_.channelCount(), 1)
+        self._dtype, self._offset, self._scale = sample_conversion(format_)
+
+        factor, self.sample_rate, self.window_size = self.analysis_format(
+            format_.sampleRate(), sample_rate)
+        self._decimator = Decimator(factor) if factor > 1 else None
+        self._ring_buffer.sample_rate = self.sample_rate
+
+        self.gate = None
+        if silence_threshold_db is not None:
+            self.gate = AudioGate(self.sample_rate, silence_threshold_db)
+
+    @classmethod
+    def analysis_format(cls, capture_rate, sample_rate=None):
+        """Return decimation factor, analysis sample rate and window size."""
+        factor = 1
+        if sample_rate:
+            factor = max(capture_rate // sample_rate, 1)
+        analysis_rate = int(round(capture_rate / factor))
+        window_size = int(cls._buffer_size * analysis_rate
+                          / cls._buffer_sample_rate)
+        return factor, analysis_rate, window_size
 
     def start(self):
         self.open(QIODevice.WriteOnly)
@@ -31,21 +69,50 @@ class AudioDataHandler(QIODevice):
 
     @Slot(QByteArray, int)
     def writeData(self, new_data, len_):
-        """Write new data to buffer.
-
-        Keeps buffer at constant size.
+        """Write new data to ring buffer.
 
         Emits:
-            data_ready(numpy.ndarray): When new data is written, emit all data
-                                       for later analysis.
+            data_ready(int): When new data is written, emit write index of the
+                             ring buffer for reading the newest window.
         """
-        self._buffer.append(new_data.data())
+        start = metrics.now()
+        data = new_data.data()
+        frame_bytes = self._dtype.itemsize * self._channels
+        samples = np.frombuffer(data, dtype=self._dtype,
+                                count=len(data) // frame_bytes * self._channels)
+        if self._channels > 1:
+            samples = samples.reshape(-1, self._channels).mean(axis=1)
 
-        data = self._buffer.data()
-        self._buffer = self._buffer.right(self._buffer_size)
+        if self._decimator is None:
+            self._ring_buffer.write(samples, self._offset, self._scale)
+        else:
+            audio = np.subtract(samples, self._offset, dtype=np.float32)
+            audio *= self._scale
+            self._ring_buffer.write(self._decimator.process(audio))
 
-        data_array = np.frombuffer(data, dtype="uint8")
-        data_array = data_array.astype("int")
-        self.data_ready.emit(data_array)
+        new_samples = self._ring_buffer.write_index - self._ring_buffer.read_index
+        end = self._ring_buffer.write_index
+        self._ring_buffer.read_index = end
+        metrics.record("ring_write", start)
+        if self.gate and not self.gate.passes(
+                self._ring_buffer.window(new_samples, end)):
+            return len_
+        metrics.window_captured(end, start)
+        self.data_ready.emit(end)
 
         return len_
+
+def sample_conversion(format_):
+    """Return dtype, offset and scale for converting PCM samples to float.
+
+    Float value is (sample - offset) * scale, between -1 and 1.
+    """
+    size = format_.sampleSize()
+    byte_order = "<" if format_.byteOrder() == QAudioFormat.LittleEndian else ">"
+    if format_.sampleType() == QAudioFormat.Float:
+        return np.dtype(byte_order + "f" + str(size // 8)), 0.0, 1.0
+
+    half_range = float(1 << (size - 1))
+    if format_.sampleType() == QAudioFormat.UnSignedInt:
+        return np.dtype(byte_order + "u" + str(size // 8)), half_range, 1.0 / half_range
+    return np.dtype(byte_order + "i" + str(size // 8)), 0.0, 1.0 / half_range
@@ -4,22 +4,145 @@ from PySide2.QtCore import QObject, Signal, Slot, QTimer
 from PySide2.QtMultimedia import QAudio, QAudioDeviceInfo, QAudioFormat, QAudioInput
 
 from audio_data_handler import AudioDataHandler
+from capture_trace import TraceRecorder
+from instrumentation import metrics
+from ring_buffer import RingBuffer
+
+class CaptureSource(QObject):
+    """Capture of one audio device into its own ring buffer.
+
+    The energy of the captured audio is tracked as an exponential average of
+    its mean square, so sources can be compared without analysing them.
+    """
+    energy_smoothing = 0.5
+
+    def __init__(self, device, ring_buffer, sample_rate=44100,
+                 silence_threshold_db=None):
+        super().__init__()
+        self.device = device
+        self.name = device.deviceName()
+        self.ring_buffer = ring_buffer
+        self.power = 0.0
+        self.pending_end = None
+
+        format_ = QAudioFormat()
+        format_.setSampleRate(AudioDevice.capture_sample_rate)
+        format_.setChannelCount(1)
+        format_.setSampleSize(16)
+        format_.setSampleType(QAudioFormat.SignedInt)
+        format_.setByteOrder(QAudioFormat.LittleEndian)
+        format_.setCodec("audio/pcm")
+
+        device_info = QAudioDeviceInfo(device)
+        if not device_info.isFormatSupported(format_):
+            print("Default format not supported - trying to use nearest.")
+            format_ = device_info.nearestFormat(format_)
+
+        self.format = format_
+        self.handler = AudioDataHandler(format_, ring_buffer, sample_rate,
+                                        silence_threshold_db)
+        self.window_size = self.handler.window_size
+        self.gate = self.handler.gate
+        self.handler.data_ready.connect(self.set_pending_end)
+        self._audio_input = QAudioInput(device, format_)
+        self._input = None
+
+    @property
+    def energy_db(self):
+        return 10.0 * np.log10(self.power + 1e-12)
+
+    def start(self):
+        self.handler.start()
+        self._audio_input.start(self.handler)
+        self._input = self._audio_input.start()
+
+    def stop(self):
+        self._audio_input.stop()
+        self.handler.stop()
+
+    @Slot(int)
+    def set_pending_end(self, end):
+        self.pending_end = end
+
+    def read(self):
+        """Write captured audio to the ring buffer and update energy.
+
+        Returns the captured data, or None if there was none.
+        """
+        len_ = self._audio_input.bytesReady()
+        if len_ <= 0:
+            return None
+        start = self.ring_buffer.write_index
+        data = self._input.readAll()
+        self.handler.writeData(data, len_)
+        new_samples = min(self.ring_buffer.write_index - start,
+                          self.ring_buffer.capacity)
+        if new_samples > 0:
+            audio = self.ring_buffer.window(new_samples)
+            power = float(np.dot(audio, audio)) / len(audio)
+            self.power += self.energy_smoothing * (power - self.power)
+        return data
 
 class AudioDevice(QObject):
-    """Class for storing computer's audio system information."""
-    data_ready = Signal(np.ndarray)
+    """Class for storing computer's audio system information.
+
+    Captured audio is kept in a shared memory ring buffer which holds a few
+    analysis windows. The buffer is kept when audio input is changed.
+
+    Audio is captured as 16bit PCM and decimated to sample_rate for analysis.
+    Silent and unchanged audio is not passed on for analysis if
+    silence_threshold_db is given.
+
+    Audio devices are listed and capture started only in start(), so the ring
+    buffer and window size are available for the analysis backend before
+    the slower audio system initialisation.
+
+    If monitor_all is True, all monitor sources are captured at the same
+    time, each to its own ring buffer. Only audio of the active source is
+    passed on for analysis. Unless a device other than a monitor is chosen,
+    the active source follows the loudest monitor, and another source must be
+    switch_margin_db louder to take over. A switch emits source_changed,
+    after which ring_buffer is the buffer of the new source, which already
+    holds its recent audio.
+
+    If record_path is given, the audio of the active source is recorded to a
+    trace with the time of every pull, see capture_trace.
+    """
+    capture_sample_rate = 44100
+    automatic_name = "Automatic"
+    switch_margin_db = 6.0
+
+    data_ready = Signal(int)
     audio_inputs = Signal(object)
-    def __init__(self, default_device_name):
+    source_changed = Signal(str)
+    def __init__(self, default_device_name, pull_interval_ms=3000,
+                 sample_rate=44100, silence_threshold_db=None,
+                 monitor_all=False, record_path=None):
         super().__init__()
+        self.record_path = record_path
+        self.recorder = None
         self.default_device_name = default_device_name
+        self.sample_rate = sample_rate
+        self.silence_threshold_db = silence_threshold_db
+        self.monitor_all = monitor_all
+        self.automatic = False
+        self.gate = None
         self._pull_timer = QTimer()
-        self._pull_timer.setInterval(3000)
+        self._pull_timer.setInterval(pull_interval_ms)
         self._pull_timer.timeout.connect(self.write_to_buffer)
 
-        self._audio_input = None
-        self._input = None
-        self._audio_data_handler = None
+        self._main_ring_buffer = RingBuffer(4 * AudioDataHandler._buffer_size)
+        _, analysis_rate, self.window_size = AudioDataHandler.analysis_format(
+            self.capture_sample_rate, sample_rate)
+        self._main_ring_buffer.sample_rate = analysis_rate
+        self.ring_buffer = self._main_ring_buffer
+        self._device = None
+        self.monitors = []
+        self.sources = []
+        self.active = None
 
+    def start(self):
+        """List audio devices and start capturing the default device."""
         devices = QAudioDeviceInfo.availableDevices(QAudio.AudioInput)
         self._device = None
         self.monitors = []
@@ -36,36 +159,69 @@ class AudioDevice(QObject):
             except IndexError:
                 self._device = QAudioDeviceInfo.defaultInputDevice()
 
-        self.initialize_audio()
+        devices = [self._device]
+        self.automatic = self.monitor_all and self._device.deviceName() in [
+            x.deviceName() for x in self.monitors]
+        if self.monitor_all:
+            devices += [x for x in self.monitors
+                        if x.deviceName() != self._device.deviceName()]
+        self.start_sources(devices)
+        if self.record_path and self.recorder is None:
+            self.recorder = TraceRecorder(self.record_path, self.active.format)
+        self.audio_inputs.emit(self.get_input_device_names())
 
-        self.start_audio()
+    def start_sources(self, devices):
+        """Capture devices, the first one to the main ring buffer."""
+        for source in self.sources:
+            source.stop()
+            if source.ring_buffer is not self._main_ring_buffer:
+                source.ring_buffer.close()
+        self.sources = []
+        for device in devices:
+            ring_buffer = self._main_ring_buffer
+            if self.sources:
+                ring_buffer = RingBuffer(ring_buffer.capacity)
+            source = CaptureSource(device, ring_buffer, self.sample_rate,
+                                   self.silence_threshold_db)
+            if source.window_size != self.window_size:
+                print("Capture sample rate of {} differs from {}.".format(
+                    source.name, self.capture_sample_rate))
+            self.sources.append(source)
+        self.set_active(self.sources[0])
+        for source in self.sources:
+            source.start()
+        self._pull_timer.start()
 
-    def initialize_audio(self):
-        """Set up parameters for audio recording."""
-        self._format = QAudioFormat()
-        self._format.setSampleRate(44100)
-        self._format.setChannelCount(1)
-        self._format.setSampleSize(8)
-        self._format.setSampleType(QAudioFormat.UnSignedInt)
-        self._format.setByteOrder(QAudioFormat.LittleEndian)
-        self._format.setCodec("audio/pcm")
-
-        device_info = QAudioDeviceInfo(self._device)
-        if not device_info.isFormatSupported(self._format):
-            print("Default format not supported - trying to use nearest.")
-            self._format = device_info.nearestFormat(self._format)
+    def set_active(self, source):
+        """Pass audio of source on for analysis."""
+        changed = self.active is not None and source is not self.active
+        self.active = source
+        self._device = source.device
+        self.ring_buffer = source.ring_buffer
+        self.gate = source.gate
+        metrics.set_gauge("active_source", source.name)
+        if changed:
+            self.source_changed.emit(source.name)
 
-        self._audio_data_handler = AudioDataHandler(self._format)
+    def initialize_audio(self):
+        """Capture only the selected device, keeping the ring buffer."""
+        self.start_sources([self._device])
 
-        self._audio_input = QAudioInput(self._device, self._format)
-        self._audio_data_handler.data_ready.connect(self.data_ready)
+    def set_pull_interval(self, interval_ms):
+        """Change how often captured audio is passed on for analysis."""
+        self._pull_timer.setInterval(interval_ms)
 
-    def start_audio(self):
-        """Start running all audio objects."""
-        self._audio_data_handler.start()
-        self._audio_input.start(self._audio_data_handler)
-        self._input = self._audio_input.start()
-        self._pull_timer.start()
+    def stop(self):
+        """Stop audio recording and release the ring buffers."""
+        self._pull_timer.stop()
+        if self.recorder:
+            self.recorder.close()
+            self.recorder = None
+        for source in self.sources:
+            source.stop()
+            if source.ring_buffer is not self._main_ring_buffer:
+                source.ring_buffer.close()
+        self._main_ring_buffer.close()
 
     def get_input_devices(self):
         devices = []
@@ -75,29 +231,55 @@ class AudioDevice(QObject):
             if item.deviceName() not in [x.deviceName() for x in devices]:
                 devices.append(item)
         system_default = QAudioDeviceInfo.defaultInputDevice()
-        if system_default not in [x.deviceName() for x in devices]:
+        if system_default.deviceName() not in [x.deviceName() for x in devices]:
             devices.append(system_default)
         return devices
 
     def get_input_device_names(self):
         devices = self.get_input_devices()
         names = [x.deviceName() for x in devices]
+        if self.monitor_all and len(self.sources) > 1:
+            names.insert(0, self.automatic_name)
         return names
 
     @Slot(str)
     def change_audio_input(self, input_name):
-        input_devices = self.monitors
-        input_devices.append(QAudioDeviceInfo.defaultInputDevice())
-        for i in range (len(input_devices)):
-            if input_devices[i].deviceName() == input_name:
-                self._device = input_devices[i]
+        if input_name == self.automatic_name:
+            self.automatic = True
+            return
+        self.automatic = False
+        for source in self.sources:
+            if source.name == input_name:
+                self.set_active(source)
+                return
+        input_devices = self.monitors + [QAudioDeviceInfo.defaultInputDevice()]
+        for device in input_devices:
+            if device.deviceName() == input_name:
+                self._device = device
                 self.initialize_audio()
-                self.start_audio()
                 break
 
+    def select_loudest(self):
+        """Make the clearly loudest source active."""
+        loudest = max(self.sources, key=lambda x: x.power)
+        if loudest is not self.active and loudest.energy_db \
+                > self.active.energy_db + self.switch_margin_db:
+            self.set_active(loudest)
+
     @Slot()
     def write_to_buffer(self):
         """Write data to buffer for later analysis."""
-        len_ = self._audio_input.bytesReady()
-        if len_ > 0:
-            self._audio_data_handler.writeData(self._input.readAll(), len_)
+        start = metrics.now()
+        for source in self.sources:
+            data = source.read()
+            if self.recorder and source is self.active:
+                self.recorder.write(data, self._pull_timer.interval())
+        if self.automatic and len(self.sources) > 1:
+            self.select_loudest()
+        metrics.record("capture", start)
+
+        end = self.active.pending_end
+        for source in self.sources:
+            source.pending_end = None
+        if end is not None:
+            self.data_ready.emit(end)
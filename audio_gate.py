@@ -0,0 +1,63 @@
+"""Gate for skipping analysis of silent or unchanged audio."""
+import zlib
+
+import numpy as np
+
+from instrumentation import metrics
+
+class AudioGate():
+    """Decide if newly captured audio is worth analysing.
+
+    Audio is rejected if its RMS level or its energy in the music band
+    (40Hz - 5kHz) is below threshold_db, for example when playback is paused
+    and the monitor source only has noise. Audio is also rejected if it has
+    the same coarse fingerprint as the previous audio, which happens when an
+    output keeps repeating its last buffer.
+
+    Skipped windows are counted in skipped_silent and skipped_unchanged.
+    """
+    block_size = 2048
+    max_blocks = 8
+    band = (40.0, 5000.0)
+    fingerprint_step = 61
+
+    def __init__(self, sample_rate, threshold_db=-60.0):
+        self.threshold = 10.0 ** (threshold_db / 20.0)
+        frequencies = np.fft.rfftfreq(self.block_size, 1.0 / sample_rate)
+        self._band = (frequencies >= self.band[0]) & (frequencies <= self.band[1])
+        self._window = np.hanning(self.block_size).astype(np.float32)
+        # Scale so that a full scale sine in the band gives amplitude 1
+        self._scale = 2.0 / np.sum(self._window) ** 2
+        self._fingerprint = None
+        self.skipped_silent = 0
+        self.skipped_unchanged = 0
+
+    def passes(self, audio):
+        """Return True if audio should be analysed."""
+        if len(audio) == 0 or self._is_silent(audio):
+            self.skipped_silent += 1
+            metrics.count("silent_windows")
+            return False
+
+        quantized = np.rint(audio[::self.fingerprint_step] * 127.0)
+        fingerprint = zlib.crc32(quantized.astype(np.int8).tobytes())
+        if fingerprint == self._fingerprint:
+            self.skipped_unchanged += 1
+            metrics.count("unchanged_windows")
+            return False
+        self._fingerprint = fingerprint
+        return True
+
+    def _is_silent(self, audio):
+        rms = np.sqrt(np.dot(audio, audio) / len(audio))
+        if rms < self.threshold:
+            return True
+
+        block_count = min(len(audio) // self.block_size, self.max_blocks)
+        if block_count == 0:
+            return False
+        blocks = audio[len(audio) - block_count * self.block_size:]
+        blocks = blocks.reshape(block_count, self.block_size) * self._window
+        power = np.abs(np.fft.rfft(blocks, axis=1)[:, self._band]) ** 2
+        band_level = np.sqrt(self._scale * power.sum() / block_count)
+        return band_level < self.threshold
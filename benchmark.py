@@ -0,0 +1,350 @@
+"""Offline accuracy and latency benchmark for the BPM pipeline.
+
+Synthetic click tracks and WAV files with known tempo are fed through
+AudioDataHandler and the BPM backends faster than real time. Each backend and
+rhythm algorithm combination is run in its own process and the benchmark
+reports extraction time per window, latency from a tempo change to the first
+correct update_bpm call, CPU time, peak memory and tempo errors, including
+half/double tempo (octave) errors.
+
+Latency is measured in audio time: time from the tempo change to the end of
+the first window giving the new tempo, plus the time spent analysing it.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --backends mp --methods numpy streaming
+    python benchmark.py --methods numpy --sample-rate 11025
+    python benchmark.py --clicks 90x20,128x20,70x20 --json results.json
+    python benchmark.py --wav song.wav:128 --wav mix.wav
+
+Tempo of a WAV file is given after a colon, or in a file with the same name
+and .tempo suffix containing lines of "start_seconds bpm".
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import wave
+
+import numpy as np
+
+from PySide2.QtCore import QByteArray, QCoreApplication
+from PySide2.QtMultimedia import QAudioFormat
+
+from audio_data_handler import AudioDataHandler
+from bpm_helper import BPMQt, BPMmp, supported_sample_rate
+from ring_buffer import RingBuffer
+
+SAMPLE_RATE = 44100
+BACKENDS = {"qt": BPMQt, "mp": BPMmp}
+METHODS = ("multifeature", "degara", "streaming", "numpy")
+DEFAULT_CLICKS = "90x24,128x24,70x24,100x24"
+TEMPO_TOLERANCE = 0.04
+WINDOW_TIMEOUT_S = 60.0
+
+def click_track(segments, sample_rate=SAMPLE_RATE):
+    """Create a click track from segments of (duration_s, bpm).
+
+    Returns audio and tempo map as a list of (start_s, bpm).
+    """
+    duration = sum(length for length, _ in segments)
+    rng = np.random.default_rng(0)
+    audio = 0.01 * rng.standard_normal(int(duration * sample_rate))
+    click_length = int(0.01 * sample_rate)
+    click = (np.sin(2.0 * np.pi * 1000.0 * np.arange(click_length) / sample_rate)
+             * np.exp(-np.linspace(0.0, 6.0, click_length)))
+
+    tempo_map = []
+    start = 0.0
+    beat_time = 0.0
+    beat = 0
+    for length, bpm in segments:
+        tempo_map.append((start, bpm))
+        start += length
+        while beat_time < start:
+            index = int(beat_time * sample_rate)
+            part = audio[index:index + click_length]
+            accent = 0.8 if beat % 4 == 0 else 0.5
+            part += accent * click[:len(part)]
+            beat_time += 60.0 / bpm
+            beat += 1
+    return audio.astype(np.float32), tempo_map
+
+def parse_clicks(spec):
+    """Parse click track segments from "bpm x seconds" list like 90x20,128x20."""
+    segments = []
+    for item in spec.split(","):
+        bpm, length = item.split("x")
+        segments.append((float(length), float(bpm)))
+    return segments
+
+def read_wav(path, sample_rate=SAMPLE_RATE):
+    """Read PCM WAV file as mono float32 at sample_rate."""
+    with wave.open(path, "rb") as wav_file:
+        channels = wav_file.getnchannels()
+        width = wav_file.getsampwidth()
+        rate = wav_file.getframerate()
+        frames = wav_file.readframes(wav_file.getnframes())
+
+    if width == 1:
+        audio = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32)
+                 - 128.0) / 128.0
+    elif width == 2:
+        audio = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768.0
+    elif width == 4:
+        audio = (np.frombuffer(frames, dtype="<i4").astype(np.float32)
+                 / 2147483648.0)
+    else:
+        raise ValueError("Unsupported sample width in {}".format(path))
+    audio = audio.reshape(-1, channels).mean(axis=1)
+
+    if rate != sample_rate:
+        times = np.arange(int(len(audio) * sample_rate / rate)) / sample_rate
+        audio = np.interp(times, np.arange(len(audio)) / rate, audio)
+    return audio.astype(np.float32)
+
+def read_tempo_map(path):
+    """Read tempo map lines of "start_seconds bpm"."""
+    tempo_map = []
+    with open(path) as tempo_file:
+        for line in tempo_file:
+            if line.strip() and not line.startswith("#"):
+                start, bpm = line.split()
+                tempo_map.append((float(start), float(bpm)))
+    return tempo_map
+
+def load_source(spec):
+    """Return audio and tempo map for "clicks:<segments>" or "wav:<path>"."""
+    kind, _, value = spec.partition(":")
+    if kind == "clicks":
+        return click_track(parse_clicks(value))
+
+    path, _, bpm = value.rpartition(":")
+    if not path or not bpm.replace(".", "", 1).isdigit():
+        path, bpm = value, ""
+    if bpm:
+        tempo_map = [(0.0, float(bpm))]
+    else:
+        tempo_map = read_tempo_map(os.path.splitext(path)[0] + ".tempo")
+    return read_wav(path), tempo_map
+
+def tempo_at(tempo_map, time_s):
+    bpm = tempo_map[0][1]
+    for start, tempo in tempo_map:
+        if start <= time_s:
+            bpm = tempo
+    return bpm
+
+def classify(bpm, true_bpm):
+    """Return "correct", "octave" or "wrong" for an estimate."""
+    if abs(bpm - true_bpm) <= TEMPO_TOLERANCE * true_bpm:
+        return "correct"
+    for factor in (2.0, 0.5, 3.0, 1.0 / 3.0):
+        if abs(bpm - factor * true_bpm) <= TEMPO_TOLERANCE * factor * true_bpm:
+            return "octave"
+    return "wrong"
+
+def to_pcm(audio):
+    """Encode audio in the capture format used by AudioDevice."""
+    return (np.clip(audio * 32768.0, -32768.0, 32767.0)
+            .astype("<i2").tobytes())
+
+def capture_format():
+    format_ = QAudioFormat()
+    format_.setSampleRate(SAMPLE_RATE)
+    format_.setChannelCount(1)
+    format_.setSampleSize(16)
+    format_.setSampleType(QAudioFormat.SignedInt)
+    format_.setByteOrder(QAudioFormat.LittleEndian)
+    format_.setCodec("audio/pcm")
+    return format_
+
+def wait_until_idle(app, backend):
+    """Process events until backend has analysed all windows sent to it."""
+    deadline = time.perf_counter() + WINDOW_TIMEOUT_S
+    while time.perf_counter() < deadline:
+        app.processEvents()
+        if isinstance(backend, BPMmp):
+            backend.update_bpm()
+        if backend.in_flight == 0:
+            app.processEvents()
+            return True
+        time.sleep(0.001)
+    return False
+
+def percentile(values, percent):
+    if not values:
+        return None
+    return float(np.percentile(values, percent))
+
+def run_single(source, backend_name, method, interval_s, sample_rate):
+    """Run one benchmark in this process and return the results."""
+    app = QCoreApplication.instance() or QCoreApplication(sys.argv[:1])
+    audio, tempo_map = load_source(source)
+
+    ring_buffer = RingBuffer(4 * AudioDataHandler._buffer_size)
+    handler = AudioDataHandler(capture_format(), ring_buffer,
+                               supported_sample_rate(method, sample_rate))
+    handler.start()
+    window_size = handler.window_size
+    window_s = window_size / handler.sample_rate
+
+    estimates = []
+    window = {}
+    def record_bpm(bpm, result=None):
+        estimates.append((window["end_s"], window["index"], bpm))
+
+    backend = BACKENDS[backend_name](record_bpm, ring_buffer, window_size,
+                                     algorithm=method)
+    handler.data_ready.connect(backend.start_bpm_calculation)
+    # Start up of the analyser is not part of the extraction time
+    backend.wait_until_ready(WINDOW_TIMEOUT_S)
+
+    pcm = to_pcm(audio)
+    bytes_per_second = 2 * SAMPLE_RATE
+    chunk = 2 * int(interval_s * SAMPLE_RATE)
+    extraction_s = []
+    timeouts = 0
+    wall_start = time.perf_counter()
+    for index, start in enumerate(range(0, len(pcm) - chunk + 1, chunk)):
+        window["index"] = index
+        window["end_s"] = (start + chunk) / bytes_per_second
+        window_start = time.perf_counter()
+        handler.writeData(QByteArray(pcm[start:start + chunk]), chunk)
+        if not wait_until_idle(app, backend):
+            timeouts += 1
+        extraction_s.append(time.perf_counter() - window_start)
+    wall_s = time.perf_counter() - wall_start
+
+    backend.stop()
+    handler.stop()
+    ring_buffer.close()
+
+    usage_self = resource.getrusage(resource.RUSAGE_SELF)
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_s = (usage_self.ru_utime + usage_self.ru_stime
+             + usage_children.ru_utime + usage_children.ru_stime)
+    peak_rss_mb = max(usage_self.ru_maxrss, usage_children.ru_maxrss) / 1024.0
+
+    # Accuracy is measured only from windows with a single tempo
+    counts = {"correct": 0, "octave": 0, "wrong": 0}
+    errors = []
+    for end_s, _, bpm in estimates:
+        tempos = {tempo_at(tempo_map, t)
+                  for t in np.linspace(max(end_s - window_s, 0.0), end_s, 20)}
+        if len(tempos) != 1:
+            continue
+        true_bpm = tempos.pop()
+        counts[classify(bpm, true_bpm)] += 1
+        errors.append(abs(bpm - true_bpm) / true_bpm)
+
+    latencies = []
+    for start, bpm in tempo_map:
+        latency = None
+        for end_s, index, estimate in estimates:
+            if end_s >= start and classify(estimate, bpm) == "correct":
+                latency = end_s - start + extraction_s[index]
+                break
+        latencies.append(latency)
+
+    duration_s = len(audio) / SAMPLE_RATE
+    return {
+        "source": source,
+        "backend": backend_name,
+        "method": method,
+        "sample_rate": handler.sample_rate,
+        "windows": len(extraction_s),
+        "estimates": len(estimates),
+        "timeouts": timeouts,
+        "dropped_windows": backend.dropped_windows,
+        "extraction_ms_mean": 1000.0 * float(np.mean(extraction_s)),
+        "extraction_ms_p95": 1000.0 * percentile(extraction_s, 95),
+        "extraction_ms_max": 1000.0 * float(np.max(extraction_s)),
+        "latency_s": latencies,
+        "cpu_s": cpu_s,
+        "peak_rss_mb": peak_rss_mb,
+        "realtime_factor": duration_s / wall_s,
+        "correct": counts["correct"],
+        "octave_errors": counts["octave"],
+        "wrong": counts["wrong"],
+        "mean_error_percent": 100.0 * float(np.mean(errors)) if errors else None,
+    }
+
+def format_latency(latencies):
+    return ",".join("-" if x is None else "{:.1f}".format(x) for x in latencies)
+
+def print_table(results):
+    header = ("{:<8} {:<13} {:>7} {:>8} {:>8} {:>7} {:>7} {:>6} {:>7} "
+              "{:>6} {:>5}  {}")
+    print(header.format("backend", "method", "windows", "mean_ms", "p95_ms",
+                        "cpu_s", "rss_mb", "x_rt", "correct", "octave",
+                        "wrong", "latency_s"))
+    for result in results:
+        print(header.format(
+            result["backend"], result["method"], result["windows"],
+            "{:.1f}".format(result["extraction_ms_mean"]),
+            "{:.1f}".format(result["extraction_ms_p95"]),
+            "{:.1f}".format(result["cpu_s"]),
+            "{:.0f}".format(result["peak_rss_mb"]),
+            "{:.1f}".format(result["realtime_factor"]),
+            result["correct"], result["octave_errors"], result["wrong"],
+            format_latency(result["latency_s"])))
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark BPM backends with audio of known tempo.")
+    parser.add_argument("--clicks", action="append", default=[],
+                        help="Click track as bpm x seconds list, e.g. "
+                             "90x20,128x20. Used by default.")
+    parser.add_argument("--wav", action="append", default=[],
+                        help="WAV file, optionally followed by :bpm.")
+    parser.add_argument("--backends", nargs="+", choices=sorted(BACKENDS),
+                        default=["qt", "mp"])
+    parser.add_argument("--methods", nargs="+", choices=METHODS,
+                        default=["multifeature", "degara"])
+    parser.add_argument("--interval", type=float, default=3.0,
+                        help="Seconds of audio between analysis windows.")
+    parser.add_argument("--sample-rate", type=int, default=SAMPLE_RATE,
+                        help="Analysis sample rate for streaming and numpy.")
+    parser.add_argument("--json", help="Write results to this file.")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        config = json.loads(args.run)
+        print(json.dumps(run_single(**config)))
+        return
+
+    sources = ["clicks:" + spec for spec in args.clicks]
+    sources += ["wav:" + spec for spec in args.wav]
+    if not sources:
+        sources = ["clicks:" + DEFAULT_CLICKS]
+
+    all_results = []
+    for source in sources:
+        print("Source:", source)
+        results = []
+        for backend in args.backends:
+            for method in args.methods:
+                config = {"source": source, "backend_name": backend,
+                          "method": method, "interval_s": args.interval,
+                          "sample_rate": args.sample_rate}
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__),
+                     "--run", json.dumps(config)],
+                    stdout=subprocess.PIPE, check=True,
+                    universal_newlines=True).stdout
+                results.append(json.loads(output.strip().splitlines()[-1]))
+        print_table(results)
+        print("")
+        all_results += results
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(all_results, f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -1,136 +1,468 @@
-"""This module includes two different ways for calculating tempo (BPM)"""
+"""This module includes two different ways for calculating tempo (BPM)
+
+Tempo can be found with essentia's RhythmExtractor2013 using either the
+multifeature or degara method for every window, or with the streaming method
+which analyses only the audio that arrived since the previous window. The numpy
+method is a lightweight estimator for computers too slow for essentia.
+"""
 import multiprocessing as mp
+import queue
+import threading
+import time
 
-import essentia
-import essentia.standard
+from PySide2.QtCore import (QObject, QRunnable, QThreadPool, QTimer,
+                            Signal, Slot)
 
-from PySide2.QtCore import Signal, Slot, QThread, QObject, QTimer
+from instrumentation import metrics
+from numpy_tempo import NumpyTempo, octave_evidence
+from ring_buffer import RingBuffer
+from streaming_tempo import StreamingTempo
+from tempo_result import TempoResult, no_tempo
 
-class BPMWorkerQt(QObject):
-    """Worker thread for calculating BPM with QThread.
+class RhythmAnalyser():
+    """Find tempo from audio data with a reusable rhythm extractor.
 
-    Parameters:
-        audio (numpy.ndarray): A few seconds of audio data in signed int format.
+    Creating RhythmExtractor2013 is expensive, so a single instance should be
+    kept for as long as possible and used for every analysis window.
 
-    Emits:
-        bpm(float): Emitted if found beats per minute with a high enough
-                    confidence level.
-        finished(): Emitted always when calculation is done.
+    Choose rhythm extractor algorithm based on CPU resources available.
+    Multifeature is more accurate but slower. Degara also has no confidence
+    level calculation (always returns 0), so confidence is not checked when
+    using that algorithm.
     """
-    finished = Signal()
-    bpm = Signal(float)
     min_tempo = 40
     max_tempo = 150
+    confidence_limit = 2.5
 
-    def __init__(self, audio, method="multifeature"):
-        super().__init__()
-        self.audio = audio
+    def __init__(self, method="multifeature"):
+        # Importing essentia takes about a second, so it is done only when
+        # an analyser is needed, usually in the worker process
+        import essentia.standard
         self.method = method
+        if method != "degara":
+            self.method = "multifeature"
+        self.rhythm_extractor = essentia.standard.RhythmExtractor2013(
+            method=self.method,
+            minTempo=self.min_tempo,
+            maxTempo=self.max_tempo)
 
-    Slot()
-    def extract_bpm(self):
-        """Find Beats per Minute from audio data."""
-        if self.method == "degara":
-            rhythm_extractor = essentia.standard.RhythmExtractor2013(
-                method="degara",
-                minTempo=self.min_tempo,
-                maxTempo=self.max_tempo)
-            bpm, _, _, _, _ = rhythm_extractor(self.audio)
-            self.bpm.emit(bpm)
-        else:
-            rhythm_extractor = essentia.standard.RhythmExtractor2013(
-                method="multifeature",
-                minTempo=self.min_tempo,
-                maxTempo=self.max_tempo)
-            bpm, _, beats_confidence, _, _ = rhythm_extractor(self.audio)
-            #print("BPM: {} Confidence: {}".format(bpm, beats_confidence))
-            if beats_confidence > 2.5:
-                self.bpm.emit(bpm)
-
-        self.finished.emit()
-        return 0
+    def reset(self):
+        """Nothing to forget, every window is analysed on its own."""
+
+    def analyse(self, audio):
+        """Return TempoResult of audio with bpm -1 if not found reliably."""
+        bpm, ticks, beats_confidence, _, _ = self.rhythm_extractor(audio)
+        #print("BPM: {} Confidence: {}".format(bpm, beats_confidence))
+        if self.method == "degara" or beats_confidence > self.confidence_limit:
+            beats = tuple(float(x) - len(audio) / 44100.0 for x in ticks)
+            return TempoResult(float(bpm), float(beats_confidence), beats)
+        return no_tempo(float(beats_confidence))
+
+    def analyse_ring_buffer(self, ring_buffer, end, window_size):
+        """Return TempoResult of window_size samples ending at end."""
+        return self.analyse(ring_buffer.window(window_size, end))
+
+def supported_sample_rate(method, sample_rate):
+    """Return the sample rate closest to sample_rate usable with method.
+
+    RhythmExtractor2013 only works with 44100Hz audio.
+    """
+    if method in ("streaming", "numpy"):
+        return sample_rate
+    return 44100
+
+def create_analyser(method="multifeature", sample_rate=44100):
+    """Create a rhythm analyser for method."""
+    if method == "streaming":
+        return StreamingTempo(sample_rate,
+                              min_tempo=RhythmAnalyser.min_tempo,
+                              max_tempo=RhythmAnalyser.max_tempo)
+    if method == "numpy":
+        return NumpyTempo(sample_rate,
+                          min_tempo=RhythmAnalyser.min_tempo,
+                          max_tempo=RhythmAnalyser.max_tempo)
+    return RhythmAnalyser(method)
+
+def add_octave_evidence(result, ring_buffer, end, window_size):
+    """Return result with beat strength evidence of the analysed window."""
+    if result.bpm <= 0 or not result.beats:
+        return result
+    return result._replace(octave_evidence=octave_evidence(
+        ring_buffer.window(window_size, end), ring_buffer.sample_rate,
+        result.beats))
+
+class BPMTaskSignals(QObject):
+    """Signals of BPMTask, which is not a QObject.
+
+    Emits:
+        finished((BPMTask, TempoResult)): Emitted when a window has been
+                                          analysed, bpm is -1 if no tempo was
+                                          found.
+    """
+    finished = Signal(object)
+
+class BPMTask(QRunnable):
+    """Analyse one audio window in a thread pool thread.
+
+    An idle analyser of the engine is used for the analysis and given back
+    afterwards, so analysers are created only when all are busy.
+
+    Parameters:
+        engine (BPMQt): Engine owning the analysers and signals.
+        ring_buffer (RingBuffer): Buffer holding the audio data.
+        end (int): Write index of the last sample of the window.
+        window_size (int): Number of samples analysed.
+        capture_ns (int): Monotonic capture time of the end of the window.
+        generation (int): Analysers of an older generation are reset first.
+    """
+    def __init__(self, engine, ring_buffer, end, window_size, capture_ns,
+                 generation):
+        super().__init__()
+        # The engine keeps a reference until the finished signal is handled
+        self.setAutoDelete(False)
+        self.engine = engine
+        self.ring_buffer = ring_buffer
+        self.end = end
+        self.window_size = window_size
+        self.capture_ns = capture_ns
+        self.generation = generation
+
+    def run(self):
+        """Find Beats per Minute from audio data.
+
+        finished is always emitted, with no tempo if the analysis failed.
+        """
+        start = metrics.now()
+        metrics.record_window("queue_wait", self.end, start)
+        result = no_tempo()
+        analyser = None
+        try:
+            analyser = self.engine.take_analyser(self.generation)
+            result = analyser.analyse_ring_buffer(self.ring_buffer, self.end,
+                                                  self.window_size)
+            result = add_octave_evidence(result, self.ring_buffer, self.end,
+                                         self.window_size)
+            metrics.record("analysis", start)
+            if self.ring_buffer.overwritten(self.window_size, self.end):
+                metrics.count("stale_windows")
+                result = no_tempo()
+        except Exception as err:
+            print("Tempo analysis failed:", err)
+            result = no_tempo()
+        finally:
+            if analyser is not None:
+                self.engine.give_analyser(analyser, self.generation)
+            self.engine.signals.finished.emit(
+                (self, result._replace(timestamp_ns=self.capture_ns)))
 
 class BPMQt():
-    """Calculate BPM using a QThread."""
-    def __init__(self, bpm_set_fun, algorithm="multifeature"):
+    """Calculate BPM in a thread pool.
+
+    Audio windows are read from the ring buffer without copying. At most
+    max_in_flight windows are analysed at the same time, each with its own
+    analyser, and analysers are reused for later windows. One more window can
+    wait for a free thread. A newer window replaces it, so the newest window
+    always wins. Results of windows older than an already applied one are
+    discarded. The streaming method keeps state between windows, so it
+    analyses one window at a time. window_size can be changed between windows.
+
+    The first analyser is created in a background thread, so that importing
+    essentia does not delay starting the user interface.
+
+    Windows can be read from another ring buffer after set_ring_buffer, for
+    example when the audio source changes.
+    """
+    def __init__(self, bpm_set_fun, ring_buffer, window_size,
+                 algorithm="multifeature", max_in_flight=1):
         self.bpm_set_fun = bpm_set_fun
+        self.ring_buffer = ring_buffer
+        self.window_size = window_size
         self.essentia_rhythm_algorithm = algorithm
-        self.worker = None
-        self.worker_thread = None
-
-    def start_bpm_calculation(self, audio):
-        """Set up thread and start BPM calculation."""
-        self.worker = BPMWorkerQt(audio, self.essentia_rhythm_algorithm)
-        self.worker_thread = QThread()
-        self.worker_thread.started.connect(self.worker.extract_bpm)
-        self.worker.finished.connect(self.worker_thread.quit)
-        self.worker.bpm.connect(self.update_bpm)
-        self.worker.moveToThread(self.worker_thread)
-        self.worker_thread.start()
-
-    def update_bpm(self, bpm):
+        if algorithm == "streaming":
+            max_in_flight = 1
+        self.max_in_flight = max_in_flight
+        self.analyser = None
+        self._analysers = queue.Queue()
+        self._analyser_loader = threading.Thread(target=self._create_analyser,
+                                                 daemon=True)
+        self._analyser_loader.start()
+        self.dropped_windows = 0
+        self._tasks = set()
+        self._waiting = None
+        self._generation = 0
+        self._applied = (0, 0)
+        self._stopping = False
+        self._analysed_ring_buffer = ring_buffer
+
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(max_in_flight)
+        # Keep threads alive between windows instead of recreating them
+        self.pool.setExpiryTimeout(-1)
+        self.signals = BPMTaskSignals()
+        self.signals.finished.connect(self.task_finished)
+
+    def _create_analyser(self):
+        self.analyser = create_analyser(self.essentia_rhythm_algorithm,
+                                        self.ring_buffer.sample_rate)
+        self._analysers.put((self.analyser, 0))
+        metrics.startup_phase("analyser_ready")
+
+    def wait_until_ready(self, timeout=None):
+        """Wait until the analyser has been created."""
+        self._analyser_loader.join(timeout)
+        return self.analyser is not None
+
+    def take_analyser(self, generation):
+        """Return an idle analyser, reset if it analysed another buffer."""
+        try:
+            analyser, analyser_generation = self._analysers.get_nowait()
+        except queue.Empty:
+            return create_analyser(self.essentia_rhythm_algorithm,
+                                   self.ring_buffer.sample_rate)
+        if analyser_generation != generation:
+            analyser.reset()
+        return analyser
+
+    def give_analyser(self, analyser, generation):
+        self._analysers.put((analyser, generation))
+
+    def start_bpm_calculation(self, end):
+        """Start BPM calculation for window ending at end."""
+        if self._stopping:
+            return
+        if self.analyser is None:
+            self._analyser_loader.join()
+        if self.ring_buffer is not self._analysed_ring_buffer:
+            self._generation += 1
+            self._analysed_ring_buffer = self.ring_buffer
+        if self._waiting is not None and self.pool.tryTake(self._waiting):
+            self._tasks.discard(self._waiting)
+            self.dropped_windows += 1
+            metrics.count("dropped_windows")
+        self._waiting = None
+
+        task = BPMTask(self, self.ring_buffer, end, self.window_size,
+                       self.ring_buffer.write_time_ns, self._generation)
+        self._tasks.add(task)
+        if len(self._tasks) > self.max_in_flight:
+            self._waiting = task
+        self.pool.start(task)
+        metrics.set_gauge("in_flight", self.in_flight)
+
+    def set_ring_buffer(self, ring_buffer):
+        """Analyse windows of another ring buffer from now on."""
+        self.ring_buffer = ring_buffer
+
+    @property
+    def in_flight(self):
+        """Number of windows being analysed or waiting for a thread."""
+        return len(self._tasks)
+
+    @Slot(object)
+    def task_finished(self, task_result):
+        task, result = task_result
+        self._tasks.discard(task)
+        if task is self._waiting:
+            self._waiting = None
+        metrics.set_gauge("in_flight", self.in_flight)
+        if self._stopping or (task.generation, task.end) < self._applied:
+            return
+        self._applied = (task.generation, task.end)
+        self.update_bpm(task, result)
+
+    def update_bpm(self, task, result):
         """Update BPM for changing Gandalf gif's playback speed."""
-        if 0 < bpm < 300:
-            self.bpm_set_fun(bpm)
+        if 0 < result.bpm < 300:
+            start = metrics.now()
+            self.bpm_set_fun(result.bpm, result)
+            metrics.record("apply", start)
+            metrics.record_window("window_latency", task.end)
+
+    def stop(self, timeout_ms=10000):
+        """Drop waiting windows and wait for running ones to finish."""
+        self._stopping = True
+        self.pool.clear()
+        self.pool.waitForDone(timeout_ms)
+        self._tasks.clear()
+        self._waiting = None
 
 class BPMmp():
-    """Calculate BPM using Python's native multiprocessing module."""
-    def __init__(self, bpm_set_fun, algorithm="multifeature"):
+    """Calculate BPM using Python's native multiprocessing module.
+
+    A single long-lived worker process keeps its rhythm extractor warm and
+    analyses audio windows from a one-slot input queue. If the worker is still
+    busy when a new window arrives, the waiting window is replaced, so the
+    newest window always wins and at most one analysis runs at a time. The
+    GUI thread never waits for the queue: a window which does not fit yet is
+    kept as pending, replaced by newer windows, and sent by the result timer.
+
+    The worker attaches to the shared memory ring buffer, so only the write
+    index of each window is sent to it instead of the audio itself. Results are
+    returned with monotonic timestamps of the analysis for instrumentation.
+
+    window_size can be changed between windows.
+
+    The worker is started immediately, so it imports essentia and creates its
+    analyser while the rest of the program starts. The main process never
+    imports essentia.
+
+    Each window names its ring buffer, so set_ring_buffer switches to another
+    buffer without restarting the worker. A worker which has died is
+    restarted when the next window arrives.
+    """
+    def __init__(self, bpm_set_fun, ring_buffer, window_size,
+                 algorithm="multifeature"):
         self.bpm_set_fun = bpm_set_fun
+        self.ring_buffer = ring_buffer
+        self.window_size = window_size
         self.essentia_rhythm_algorithm = algorithm
-
-        self.queue = mp.Queue()
-        self.process = None
+        self.dropped_windows = 0
+        self.start_worker()
 
         self.bpm_timer = QTimer()
-        self.bpm_timer.setInterval(1000)
+        self.bpm_timer.setInterval(200)
         self.bpm_timer.timeout.connect(self.update_bpm)
         self.bpm_timer.start()
 
-
-    def start_bpm_calculation(self, audio):
-        """Start new process to calculate BPM."""
-        self.process = mp.Process(target=self.bpm_helper,
-                                  args=(self.queue,
-                                        audio,
-                                        self.essentia_rhythm_algorithm))
+    def start_worker(self, context=mp):
+        """Start worker process with empty queues using context."""
+        self.audio_queue = context.Queue(maxsize=1)
+        self.queue = context.Queue()
+        self.ready = context.Event()
+        self.in_flight = 0
+        self._pending_window = None
+        self.process = context.Process(target=self.bpm_helper,
+                                       args=(self.audio_queue,
+                                             self.queue,
+                                             self.ring_buffer.name,
+                                             self.ring_buffer.capacity,
+                                             self.essentia_rhythm_algorithm,
+                                             self.ready),
+                                       daemon=True)
         self.process.start()
 
+    def wait_until_ready(self, timeout=None):
+        """Wait until the worker process has created its analyser."""
+        return self.ready.wait(timeout)
+
+    def start_bpm_calculation(self, end):
+        """Send window to worker process, replacing a window still waiting."""
+        if not self.process.is_alive():
+            print("BPM worker process stopped with exit code",
+                  self.process.exitcode, "- restarting it")
+            # Other threads are running by now, which makes forking unsafe
+            self.start_worker(mp.get_context("spawn"))
+        if self._pending_window is not None:
+            self._pending_window = None
+            self.drop_window()
+        try:
+            self.audio_queue.get_nowait()
+            self.drop_window()
+        except queue.Empty:
+            pass
+        self._pending_window = (self.ring_buffer.name, end, self.window_size,
+                                self.ring_buffer.write_time_ns)
+        self.in_flight += 1
+        metrics.set_gauge("in_flight", self.in_flight)
+        self.send_pending_window()
+
+    def send_pending_window(self):
+        """Pass the newest window to the worker without blocking."""
+        if self._pending_window is None:
+            return
+        try:
+            self.audio_queue.put_nowait(self._pending_window)
+            self._pending_window = None
+        except queue.Full:
+            # The previous window is still in the feeder thread of the queue,
+            # so it could not be removed. Sent again from update_bpm.
+            pass
+
+    def drop_window(self):
+        self.dropped_windows += 1
+        self.in_flight -= 1
+        metrics.count("dropped_windows")
+
+    def set_ring_buffer(self, ring_buffer):
+        """Analyse windows of another ring buffer from now on."""
+        self.ring_buffer = ring_buffer
+
     def update_bpm(self):
         """Update BPM for changing Gandalf gif's playback speed."""
+        if self.ready.is_set():
+            metrics.startup_phase("analyser_ready")
+        self.send_pending_window()
+        try:
+            while True:
+                end, result, start_ns, end_ns, stale = self.queue.get(False)
+                self.in_flight -= 1
+                metrics.set_gauge("in_flight", self.in_flight)
+                metrics.record_window("queue_wait", end, start_ns)
+                metrics.record("analysis", start_ns, end_ns)
+                metrics.record("result_wait", end_ns)
+                if stale:
+                    metrics.count("stale_windows")
+                if 0 < result.bpm < 300:
+                    start = metrics.now()
+                    self.bpm_set_fun(result.bpm, result)
+                    metrics.record("apply", start)
+                    metrics.record_window("window_latency", end)
+        except queue.Empty:
+            pass
+
+    def stop(self):
+        """Stop worker process."""
+        self.bpm_timer.stop()
         try:
-            bpm = self.queue.get(False)
-            self.process.join()
-            if 0 < bpm < 300:
-                self.bpm_set_fun(bpm)
-        except mp.queues.Empty:
+            self.audio_queue.get_nowait()
+        except queue.Empty:
             pass
+        self.audio_queue.put(None)
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
 
     @staticmethod
-    def bpm_helper(queue, audio, method="multifeature"):
-        """Find Beats per Minute from audio data.
+    def bpm_helper(audio_queue, queue_, ring_name, ring_capacity,
+                   method="multifeature", ready=None):
+        """Find Beats per Minute from audio data until stopped with None.
+
+        Each window is given as (ring_name, end, window_size, capture_ns).
+        When the ring buffer changes, the new one is attached by name and the
+        analyser is reset.
 
-        Choose rhythm extractor algorithm based on CPU resources available.
-        Multifeature is more accurate but slower. Degara also has no confidence
-        level calculation (always returns 0), so remove it if using that algorithm.
+        Windows overwritten during analysis and windows whose analysis fails
+        are answered with no tempo.
         """
-        min_tempo = 40
-        max_tempo = 150
-        if method == "degara":
-            rhythm_extractor = essentia.standard.RhythmExtractor2013(
-                method="degara", minTempo=min_tempo, maxTempo=max_tempo)
-            bpm, _, _, _, _ = rhythm_extractor(audio)
-            #print("BPM:", bpm)
-            queue.put(bpm)
-
-        else:
-            rhythm_extractor = essentia.standard.RhythmExtractor2013(
-                method="multifeature", minTempo=min_tempo, maxTempo=max_tempo)
-            bpm, _, beats_confidence, _, _ = rhythm_extractor(audio)
-            #print("BPM: {} Confidence: {}".format(bpm, beats_confidence))
-            if beats_confidence > 2.5:
-                queue.put(bpm)
-            else:
-                queue.put(-1)
+        ring_buffer = RingBuffer(ring_capacity, name=ring_name)
+        analyser = create_analyser(method, ring_buffer.sample_rate)
+        if ready is not None:
+            ready.set()
+        while True:
+            window = audio_queue.get()
+            if window is None:
+                break
+            name, end, window_size, capture_ns = window
+            if name != ring_buffer.name:
+                ring_buffer.close()
+                ring_buffer = RingBuffer(ring_capacity, name=name)
+                analyser.reset()
+            start_ns = time.monotonic_ns()
+            try:
+                result = analyser.analyse_ring_buffer(ring_buffer, end,
+                                                      window_size)
+                result = add_octave_evidence(result, ring_buffer, end,
+                                             window_size)
+            except Exception as err:
+                # One bad window must not stop the worker
+                print("Tempo analysis failed:", err)
+                result = no_tempo()
+            end_ns = time.monotonic_ns()
+            stale = ring_buffer.overwritten(window_size, end)
+            if stale:
+                result = no_tempo()
+            queue_.put((end, result._replace(timestamp_ns=capture_ns),
+                        start_ns, end_ns, stale))
 
+        ring_buffer.close()
         return 0
@@ -0,0 +1,156 @@
+"""Build the long video loop and find the tempo of the video.
+
+The short clip is repeated with a single ffmpeg remux, so the long video is
+written once without re-encoding. The number of repeats is chosen so that
+the long video is at least --duration seconds long but at most --max-size
+bytes.
+
+The nod period is found from the frames of the short clip. Frames one nod
+apart look alike, so the difference between each frame and the frame a
+given number of frames later has a minimum at whole nods. The clip loops
+seamlessly, so it holds a whole number of nods, and video_loop_bpm is
+written to config.JSON from that number and the clip duration.
+
+Usage:
+    python build_loop.py
+    python build_loop.py --duration 1800 --interpolate 60 --no-config
+"""
+import argparse
+import json
+import math
+import os
+import subprocess
+import tempfile
+
+import numpy as np
+
+DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+
+def probe(video_path):
+    """Return (duration in seconds, width, height) of a video."""
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0",
+         "-show_entries", "stream=width,height:format=duration",
+         "-of", "json", video_path],
+        check=True, capture_output=True)
+    info = json.loads(result.stdout)
+    stream = info["streams"][0]
+    return float(info["format"]["duration"]), stream["width"], stream["height"]
+
+def read_frames(video_path, height=64):
+    """Return frames of a video as grayscale float32 of the given height."""
+    _, width, original_height = probe(video_path)
+    width = 2 * max(round(width * height / original_height / 2), 1)
+    result = subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", video_path, "-an",
+         "-vf", "scale={}:{}".format(width, height),
+         "-f", "rawvideo", "-pix_fmt", "gray", "-"],
+        check=True, capture_output=True)
+    frames = np.frombuffer(result.stdout, dtype=np.uint8)
+    return frames.reshape(-1, height, width).astype(np.float32)
+
+def count_nods(frames, min_nod_frames=4, threshold=0.5):
+    """Return number of nods in a seamlessly looping clip.
+
+    The nod period is the shortest lag at which the difference between
+    frames that far apart has a clear minimum: a local minimum below
+    threshold times the median difference of all lags, after the difference
+    has first risen above the median. Neighbouring frames of smooth motion
+    are always alike, so a low difference alone does not make a nod. Falls
+    back to one nod per clip.
+    """
+    count = len(frames)
+    if count < 2 * min_nod_frames:
+        return 1
+    differences = np.zeros(count + 1)
+    for lag in range(1, count):
+        differences[lag] = np.mean(np.abs(frames - np.roll(frames, -lag,
+                                                           axis=0)))
+    median = np.median(differences[1:count])
+    limit = threshold * median
+    for lag in range(min_nod_frames, count // 2 + 1):
+        if differences[lag] <= limit \
+                and differences[lag] <= differences[lag - 1] \
+                and differences[lag] <= differences[lag + 1] \
+                and differences[1:lag].max() > median:
+            return max(round(count / lag), 1)
+    return 1
+
+def loop_bpm(video_path):
+    """Return tempo of the nods in a looping video."""
+    duration, _, _ = probe(video_path)
+    nods = count_nods(read_frames(video_path))
+    return 60.0 * nods / duration, nods
+
+def build_long_video(video_path, output_path, duration_s=3600.0,
+                     max_size=1000000000, interpolate_fps=0):
+    """Write output_path as the clip repeated, without audio.
+
+    Returns number of repeats.
+    """
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        if interpolate_fps:
+            clip_path = os.path.join(temporary_dir, "clip.mp4")
+            subprocess.run(
+                ["ffmpeg", "-v", "error", "-i", video_path, "-an", "-vf",
+                 "minterpolate=fps={:g}:mi_mode=mci:mc_mode=aobmc:vsbmc=1"
+                 .format(interpolate_fps), clip_path],
+                check=True)
+        else:
+            clip_path = video_path
+        clip_duration, _, _ = probe(clip_path)
+        clip_size = os.path.getsize(clip_path)
+        repeats = max(min(math.ceil(duration_s / clip_duration),
+                          max_size // clip_size), 2)
+
+        temporary_path = output_path + ".tmp.mp4"
+        subprocess.run(
+            ["ffmpeg", "-v", "error", "-y", "-stream_loop", str(repeats - 1),
+             "-i", clip_path, "-an", "-c", "copy", temporary_path],
+            check=True)
+        os.replace(temporary_path, output_path)
+    return repeats
+
+def update_config(config_path, bpm):
+    with open(config_path, encoding="utf-8") as f:
+        config = json.load(f)
+    config["video_loop_bpm"] = round(bpm, 2)
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=4)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build long video loop and find tempo of the video.")
+    parser.add_argument("--video", default=DIR_PATH + "/resources/video.mp4",
+                        help="Short seamlessly looping clip.")
+    parser.add_argument("--output",
+                        default=DIR_PATH + "/resources/video_long.mp4")
+    parser.add_argument("--duration", type=float, default=3600.0,
+                        help="Target length of the long video in seconds.")
+    parser.add_argument("--max-size", type=int, default=1000000000,
+                        help="Maximum size of the long video in bytes.")
+    parser.add_argument("--interpolate", type=float, default=0,
+                        help="Interpolate clip to this frame rate first.")
+    parser.add_argument("--config", default="config.JSON")
+    parser.add_argument("--no-config", action="store_true",
+                        help="Do not write video_loop_bpm to the config.")
+    parser.add_argument("--bpm-only", action="store_true",
+                        help="Only find the tempo of the video.")
+    args = parser.parse_args()
+
+    bpm, nods = loop_bpm(args.video)
+    print("Loop has {} nods, BPM: {:.2f}".format(nods, bpm))
+    if not args.no_config:
+        update_config(args.config, bpm)
+        print("Updated video_loop_bpm in", args.config)
+    if args.bpm_only:
+        return
+
+    repeats = build_long_video(args.video, args.output, args.duration,
+                               args.max_size, args.interpolate)
+    duration, _, _ = probe(args.output)
+    print("Wrote {} ({} repeats, {:.0f} seconds, {} bytes)".format(
+        args.output, repeats, duration, os.path.getsize(args.output)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""Recording and replaying of captured audio.
+
+A trace holds the raw captured PCM data together with the time and pull
+interval of every pull of the capture timer, so that the exact audio and
+timing of a session can be analysed again later, for example while
+profiling. A trace is three files with the same base path:
+
+    .json: Capture format and start time.
+    .pcm: Captured bytes.
+    .pulls: int64 triplets of monotonic time in ns from the start, end offset
+            in the .pcm file and pull interval in ms, one for each pull.
+"""
+import json
+import os
+import time
+
+import numpy as np
+
+from PySide2.QtCore import QByteArray, QObject, Qt, QTimer, Signal, Slot
+from PySide2.QtMultimedia import QAudioFormat
+
+from audio_data_handler import AudioDataHandler
+from instrumentation import metrics
+from ring_buffer import RingBuffer
+
+SAMPLE_TYPES = {"signed": QAudioFormat.SignedInt,
+                "unsigned": QAudioFormat.UnSignedInt,
+                "float": QAudioFormat.Float}
+
+class TraceRecorder():
+    """Write captured audio and its pull times to a trace.
+
+    PCM data is copied into a memory mapped file which is grown in chunks,
+    so recording needs no system call for most pulls.
+
+    Parameters:
+        path (str): Base path of the trace files.
+        format_ (QAudioFormat): Format of the captured audio.
+    """
+    chunk_bytes = 16 * 1024 * 1024
+
+    def __init__(self, path, format_):
+        sample_type = [name for name, value in SAMPLE_TYPES.items()
+                       if value == format_.sampleType()]
+        metadata = {
+            "sample_rate": format_.sampleRate(),
+            "channels": format_.channelCount(),
+            "sample_size": format_.sampleSize(),
+            "sample_type": sample_type[0] if sample_type else "signed",
+            "byte_order": "little"
+                          if format_.byteOrder() == QAudioFormat.LittleEndian
+                          else "big",
+            "started": time.time(),
+        }
+        with open(path + ".json", "w", encoding="utf-8") as f:
+            json.dump(metadata, f, indent=4)
+
+        self._pcm_file = open(path + ".pcm", "w+b")
+        self._pulls_file = open(path + ".pulls", "wb")
+        self._size = 0
+        self._capacity = 0
+        self._map = None
+        self._start_ns = time.monotonic_ns()
+
+    def _grow(self, size):
+        self._map = None
+        while self._capacity < size:
+            self._capacity += self.chunk_bytes
+        self._pcm_file.truncate(self._capacity)
+        self._map = np.memmap(self._pcm_file, dtype=np.uint8, mode="r+",
+                              shape=(self._capacity,))
+
+    def write(self, data, pull_interval_ms):
+        """Record one pull which captured data, None if nothing."""
+        if isinstance(data, QByteArray):
+            data = data.data()
+        if data:
+            if self._size + len(data) > self._capacity:
+                self._grow(self._size + len(data))
+            self._map[self._size:self._size + len(data)] = np.frombuffer(
+                data, dtype=np.uint8)
+            self._size += len(data)
+        self._pulls_file.write(np.array(
+            [time.monotonic_ns() - self._start_ns, self._size,
+             pull_interval_ms], dtype=np.int64).tobytes())
+
+    def close(self):
+        if self._map is not None:
+            self._map.flush()
+            self._map = None
+        self._pcm_file.truncate(self._size)
+        self._pcm_file.close()
+        self._pulls_file.close()
+
+class TraceReplay(QObject):
+    """Feed a recorded trace through AudioDataHandler like AudioDevice does.
+
+    Pulls are replayed at their recorded times, or one after another as fast
+    as possible if real_time is False. Recorded pull times already include
+    the pull interval changes of the recording session, so
+    set_pull_interval has no effect. Emits finished after the last pull.
+
+    Has the parts of the AudioDevice interface used by the main window, the
+    headless mode and AnalysisScheduler, as a single audio source.
+    """
+    data_ready = Signal(int)
+    audio_inputs = Signal(object)
+    source_changed = Signal(str)
+    finished = Signal()
+
+    def __init__(self, path, sample_rate=44100, silence_threshold_db=None,
+                 real_time=True):
+        super().__init__()
+        with open(path + ".json", encoding="utf-8") as f:
+            metadata = json.load(f)
+        self.name = "Trace " + os.path.basename(path)
+        self.real_time = real_time
+        self.pcm = np.memmap(path + ".pcm", dtype=np.uint8, mode="r") \
+            if os.path.getsize(path + ".pcm") else np.zeros(0, np.uint8)
+        self.pulls = np.fromfile(path + ".pulls", dtype=np.int64).reshape(-1, 3)
+
+        format_ = QAudioFormat()
+        format_.setSampleRate(metadata["sample_rate"])
+        format_.setChannelCount(metadata["channels"])
+        format_.setSampleSize(metadata["sample_size"])
+        format_.setSampleType(SAMPLE_TYPES[metadata["sample_type"]])
+        format_.setByteOrder(QAudioFormat.LittleEndian
+                             if metadata["byte_order"] == "little"
+                             else QAudioFormat.BigEndian)
+        format_.setCodec("audio/pcm")
+
+        self.ring_buffer = RingBuffer(4 * AudioDataHandler._buffer_size)
+        self.handler = AudioDataHandler(format_, self.ring_buffer, sample_rate,
+                                        silence_threshold_db)
+        self.handler.data_ready.connect(self.set_pending_end)
+        self.window_size = self.handler.window_size
+        self.gate = self.handler.gate
+        # The trace is the only source
+        self.active = self
+        self.automatic = False
+        self.pending_end = None
+
+        self._index = 0
+        self._start_ns = 0
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setTimerType(Qt.PreciseTimer)
+        self._timer.timeout.connect(self.pull)
+
+    def start(self):
+        self.handler.start()
+        self._index = 0
+        self._start_ns = time.monotonic_ns()
+        self.audio_inputs.emit([self.name])
+        self._schedule()
+
+    def stop(self):
+        self._timer.stop()
+        self.handler.stop()
+        self.ring_buffer.close()
+
+    def set_pull_interval(self, interval_ms):
+        pass
+
+    @Slot(str)
+    def change_audio_input(self, input_name):
+        pass
+
+    @Slot(int)
+    def set_pending_end(self, end):
+        self.pending_end = end
+
+    def _schedule(self):
+        if self._index >= len(self.pulls):
+            self.finished.emit()
+            return
+        delay_ms = 0
+        if self.real_time:
+            due_ns = self._start_ns + self.pulls[self._index, 0]
+            delay_ms = max(int((due_ns - time.monotonic_ns()) / 1e6), 0)
+        self._timer.start(delay_ms)
+
+    @Slot()
+    def pull(self):
+        """Write the audio of the next pull to the ring buffer."""
+        start = metrics.now()
+        begin = int(self.pulls[self._index - 1, 1]) if self._index else 0
+        end = int(self.pulls[self._index, 1])
+        self._index += 1
+        if end > begin:
+            data = self.pcm[begin:end].tobytes()
+            self.handler.writeData(QByteArray(data), len(data))
+        metrics.record("capture", start)
+
+        end = self.pending_end
+        self.pending_end = None
+        if end is not None:
+            self.data_ready.emit(end)
+        self._schedule()
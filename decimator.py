@@ -0,0 +1,39 @@
+"""Anti-aliased decimation of streamed audio."""
+import numpy as np
+
+class Decimator():
+    """Decimate audio by an integer factor with an anti-alias filter.
+
+    A Blackman windowed sinc low-pass filter removes content above the new
+    Nyquist frequency before every factor:th sample is kept. The filter is
+    evaluated only for the kept samples, one tap at a time, so no large
+    temporary arrays are created. Filter state is kept between calls, so audio
+    can be given in chunks of any length.
+    """
+    taps_per_factor = 16
+
+    def __init__(self, factor):
+        self.factor = factor
+        length = self.taps_per_factor * factor + 1
+        n = np.arange(length) - (length - 1) / 2.0
+        cutoff = 0.45 / factor
+        taps = np.sinc(2.0 * cutoff * n) * np.blackman(length)
+        self._taps = (taps / taps.sum()).astype(np.float32)
+        self._history = np.zeros(length - 1, dtype=np.float32)
+
+    def process(self, audio):
+        """Return decimated float32 audio for the new samples."""
+        signal = np.concatenate((self._history, audio))
+        length = len(self._taps)
+        if len(signal) < length:
+            self._history = signal
+            return np.zeros(0, dtype=np.float32)
+        count = (len(signal) - length) // self.factor + 1
+
+        output = np.zeros(count, dtype=np.float32)
+        stop = (count - 1) * self.factor + 1
+        for index, tap in enumerate(self._taps):
+            output += tap * signal[index:index + stop:self.factor]
+
+        self._history = signal[count * self.factor:]
+        return output
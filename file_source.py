@@ -0,0 +1,158 @@
+"""Tempo analysis of audio files."""
+import os
+import subprocess
+import wave
+from collections import namedtuple
+
+import numpy as np
+
+from bpm_helper import create_analyser, supported_sample_rate
+from decimator import Decimator
+from ring_buffer import RingBuffer
+
+FileTempo = namedtuple("FileTempo", ["bpm", "confidence", "windows"])
+
+class FileSource():
+    """Read an audio file in chunks as mono float32 at 44100 Hz.
+
+    8, 16 and 32 bit PCM WAV files at 44100 Hz are read directly, and raw
+    files (.pcm, .raw) are taken as 16 bit little endian mono at 44100 Hz.
+    Other files, for example FLAC and MP3, are decoded with ffmpeg. Only one
+    chunk is in memory at a time.
+
+    Parameters:
+        path (str): Audio file.
+        chunk_samples (int): Number of samples in each chunk.
+    """
+    sample_rate = 44100
+    raw_suffixes = (".pcm", ".raw")
+
+    def __init__(self, path, chunk_samples=44100):
+        self.path = path
+        self.chunk_samples = chunk_samples
+
+    def __iter__(self):
+        suffix = os.path.splitext(self.path)[1].lower()
+        if suffix in self.raw_suffixes:
+            return self._read_raw()
+        if suffix == ".wav":
+            try:
+                with wave.open(self.path, "rb") as wav_file:
+                    if wav_file.getframerate() == self.sample_rate \
+                            and wav_file.getsampwidth() in (1, 2, 4):
+                        return self._read_wav()
+            except (wave.Error, EOFError):
+                # For example float WAV files, which ffmpeg can decode, or
+                # empty and truncated files, for which ffmpeg gives the error
+                pass
+        return self._read_ffmpeg()
+
+    def _read_wav(self):
+        with wave.open(self.path, "rb") as wav_file:
+            channels = wav_file.getnchannels()
+            width = wav_file.getsampwidth()
+            while True:
+                data = wav_file.readframes(self.chunk_samples)
+                if not data:
+                    break
+                yield pcm_to_float(data, width, channels)
+
+    def _read_raw(self):
+        with open(self.path, "rb") as raw_file:
+            while True:
+                data = raw_file.read(2 * self.chunk_samples)
+                if len(data) < 2:
+                    break
+                yield pcm_to_float(data[:len(data) // 2 * 2], 2, 1)
+
+    def _read_ffmpeg(self):
+        process = subprocess.Popen(
+            ["ffmpeg", "-v", "error", "-i", self.path, "-vn", "-ac", "1",
+             "-ar", str(self.sample_rate), "-f", "s16le", "-"],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            while True:
+                data = process.stdout.read(2 * self.chunk_samples)
+                if len(data) < 2:
+                    break
+                yield pcm_to_float(data[:len(data) // 2 * 2], 2, 1)
+        finally:
+            process.stdout.close()
+            error = process.stderr.read().decode(errors="replace").strip()
+            process.stderr.close()
+            if process.wait() != 0:
+                raise OSError("ffmpeg could not decode {}: {}".format(
+                    self.path, error))
+
+def pcm_to_float(data, width, channels):
+    """Convert little endian PCM bytes to mono float32 between -1 and 1."""
+    if width == 1:
+        audio = (np.frombuffer(data, dtype=np.uint8).astype(np.float32)
+                 - 128.0) / 128.0
+    else:
+        dtype = np.dtype("<i" + str(width))
+        audio = np.frombuffer(data, dtype=dtype).astype(np.float32)
+        audio /= float(1 << (8 * width - 1))
+    if channels > 1:
+        audio = audio[:len(audio) // channels * channels]
+        audio = audio.reshape(-1, channels).mean(axis=1)
+    return audio
+
+def combine_estimates(estimates, tolerance=0.03):
+    """Return FileTempo of the tempo most windows agree on.
+
+    estimates is a list of (bpm, confidence). Returns bpm -1 if empty.
+    """
+    if not estimates:
+        return FileTempo(-1.0, 0.0, 0)
+    best = []
+    for bpm, _ in estimates:
+        group = [x for x in estimates if abs(x[0] - bpm) <= tolerance * bpm]
+        if len(group) > len(best):
+            best = group
+    return FileTempo(float(np.mean([x[0] for x in best])),
+                     float(np.mean([x[1] for x in best])),
+                     len(estimates))
+
+def analyse_file(path, method="multifeature", sample_rate=44100,
+                 interval_s=3.0):
+    """Return FileTempo of an audio file.
+
+    Audio is decimated and written to a ring buffer like captured audio, and
+    a window of the same length as in live analysis is analysed every
+    interval_s seconds of audio.
+    """
+    sample_rate = supported_sample_rate(method, sample_rate)
+    factor = max(FileSource.sample_rate // sample_rate, 1)
+    decimator = Decimator(factor) if factor > 1 else None
+    sample_rate = int(round(FileSource.sample_rate / factor))
+    # Same window length as AudioDataHandler uses for live audio
+    window_size = int(350000 * sample_rate / 44100)
+
+    analyser = create_analyser(method, sample_rate)
+    ring_buffer = RingBuffer(2 * window_size, sample_rate)
+    estimates = []
+    analysed = False
+    try:
+        chunk_samples = int(interval_s * FileSource.sample_rate)
+        for audio in FileSource(path, chunk_samples):
+            if decimator:
+                audio = decimator.process(audio)
+            ring_buffer.write(audio)
+            if ring_buffer.write_index < window_size and method != "streaming":
+                continue
+            analysed = True
+            result = analyser.analyse_ring_buffer(
+                ring_buffer, ring_buffer.write_index, window_size)
+            if result.bpm > 0:
+                estimates.append((result.bpm, result.confidence))
+
+        if not analysed and ring_buffer.write_index:
+            # Shorter than one window
+            result = analyser.analyse_ring_buffer(
+                ring_buffer, ring_buffer.write_index, window_size)
+            if result.bpm > 0:
+                estimates.append((result.bpm, result.confidence))
+    finally:
+        ring_buffer.close()
+    return combine_estimates(estimates)
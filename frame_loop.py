@@ -0,0 +1,264 @@
+"""Seamless playback of a short video loop from decoded frames."""
+import json
+import os
+import subprocess
+import threading
+import time
+from fractions import Fraction
+
+import numpy as np
+
+from PySide2.QtCore import QObject, QRect, Qt, QTimer, Signal, Slot
+from PySide2.QtGui import QImage, QPainter
+from PySide2.QtWidgets import QWidget
+
+from instrumentation import metrics
+
+class FrameLoop():
+    """Frames of a video loop decoded once into a memory mapped file.
+
+    The video is decoded with ffmpeg to raw RGB frames, optionally scaled to
+    the given height, and stored next to the video with a small JSON file of
+    metadata. Later runs map the stored frames directly, so only the frames
+    being shown are read into memory. The frames are decoded again if the
+    video changes. With decode False, FileNotFoundError is raised instead of
+    decoding, so the slow first decode can be left to a background thread.
+
+    A variant with another frame rate can be made by giving fps. Frames are
+    interpolated with motion compensation for a higher frame rate than the
+    original, which is slow, and dropped for a lower one.
+
+    Parameters:
+        video_path (str): Path of the short video loop.
+        height (int): Height of stored frames, or 0 for the original size.
+        fps (float): Frame rate of stored frames, or 0 for the original.
+        decode (bool): Decode the video if stored frames are not up to date.
+    """
+    def __init__(self, video_path, height=0, fps=0, decode=True):
+        base = os.path.splitext(video_path)[0]
+        if height:
+            base += "_{}p".format(height)
+        if fps:
+            base += "_{:g}fps".format(fps)
+        self.frames_path = base + ".frames"
+        self.metadata_path = base + ".frames.json"
+
+        source = os.stat(video_path)
+        self.source = {"mtime": source.st_mtime, "size": source.st_size}
+        metadata = self._read_metadata()
+        if metadata is None and not decode:
+            raise FileNotFoundError("Video loop is not decoded yet: "
+                                    + self.frames_path)
+        if metadata is None:
+            metadata = self._decode(video_path, height, fps)
+
+        self.width = metadata["width"]
+        self.height = metadata["height"]
+        self.fps = float(Fraction(metadata["fps"]))
+        self.frames = np.memmap(self.frames_path, dtype=np.uint8, mode="r",
+                                shape=(metadata["frames"], self.height,
+                                       self.width, 3))
+        self.duration_ms = 1000.0 * len(self.frames) / self.fps
+
+    def _read_metadata(self):
+        try:
+            with open(self.metadata_path, encoding="utf-8") as metadata_file:
+                metadata = json.load(metadata_file)
+        except (OSError, ValueError):
+            return None
+        if metadata.get("source") != self.source \
+                or not os.path.exists(self.frames_path):
+            return None
+        return metadata
+
+    def _decode(self, video_path, height, fps):
+        probe = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "v:0",
+             "-show_entries", "stream=width,height,avg_frame_rate",
+             "-of", "json", video_path],
+            check=True, capture_output=True)
+        stream = json.loads(probe.stdout)["streams"][0]
+        width = stream["width"]
+        if height:
+            # Even width keeps all pixel formats happy
+            width = 2 * round(width * height / stream["height"] / 2)
+        else:
+            height = stream["height"]
+        filters = "scale={}:{}".format(width, height)
+        if fps and fps > float(Fraction(stream["avg_frame_rate"])):
+            filters += ",minterpolate=fps={:g}:mi_mode=mci:mc_mode=aobmc" \
+                ":vsbmc=1".format(fps)
+        elif fps:
+            filters += ",fps={:g}".format(fps)
+
+        temporary_path = self.frames_path + ".tmp"
+        subprocess.run(
+            ["ffmpeg", "-v", "error", "-y", "-i", video_path, "-an",
+             "-vf", filters,
+             "-f", "rawvideo", "-pix_fmt", "rgb24", temporary_path],
+            check=True)
+        os.replace(temporary_path, self.frames_path)
+
+        metadata = {
+            "source": self.source,
+            "width": width,
+            "height": height,
+            "fps": "{:g}".format(fps) if fps else stream["avg_frame_rate"],
+            "frames": os.path.getsize(self.frames_path) // (width * height * 3),
+        }
+        with open(self.metadata_path, "w", encoding="utf-8") as metadata_file:
+            json.dump(metadata, metadata_file)
+        return metadata
+
+class FrameLoopPlayer(QObject):
+    """Play a FrameLoop at any playback rate.
+
+    Position advances with the monotonic clock scaled by the playback rate and
+    wraps around at the end of the loop, so there is no gap between rounds and
+    changing the rate never needs seeking. Mirrors the parts of QMediaPlayer
+    used by the main window.
+
+    Variants of the loop with other frame rates can be added. If
+    max_frames_per_second is set, the variant with the highest frame rate
+    that shows at most that many frames per second at the current playback
+    rate is played, or the lowest frame rate if none does. A higher frame
+    rate is taken only with switch_margin to spare, so small rate changes do
+    not switch back and forth. Position is kept in time, so switching is
+    seamless.
+    """
+    tick_interval_ms = 5
+    switch_margin = 0.1
+
+    variant_ready = Signal(object)
+
+    def __init__(self, frame_loop, parent=None, max_frames_per_second=0):
+        super().__init__(parent)
+        self.frame_loop = frame_loop
+        self.variants = [frame_loop]
+        self.max_frames_per_second = max_frames_per_second
+        self.variant_ready.connect(self.add_variant)
+        self._output = None
+        self._rate = 1.0
+        self._position_ms = 0.0
+        self._clock_ns = time.monotonic_ns()
+        self._frame_index = -1
+        self._timer = QTimer(self)
+        self._timer.setTimerType(Qt.PreciseTimer)
+        self._timer.setInterval(self.tick_interval_ms)
+        self._timer.timeout.connect(self._tick)
+
+    def setVideoOutput(self, widget):
+        self._output = widget
+
+    def play(self):
+        self._clock_ns = time.monotonic_ns()
+        self._timer.start()
+
+    def stop(self):
+        self._timer.stop()
+
+    def playbackRate(self):
+        return self._rate
+
+    def setPlaybackRate(self, rate):
+        self._advance()
+        self._rate = rate
+        self._select_variant()
+
+    def position(self):
+        self._advance()
+        return int(self._position_ms)
+
+    def setPosition(self, position_ms):
+        self._advance()
+        self._position_ms = position_ms % self.frame_loop.duration_ms
+
+    def load_variants(self, video_path, height, frame_rates):
+        """Decode variants with frame_rates in a thread and add them."""
+        def load():
+            for fps in frame_rates:
+                try:
+                    self.variant_ready.emit(FrameLoop(video_path, height, fps))
+                except (OSError, subprocess.CalledProcessError) as err:
+                    print("Could not make {:g} fps video loop:".format(fps),
+                          err)
+        threading.Thread(target=load, daemon=True).start()
+
+    @Slot(object)
+    def add_variant(self, frame_loop):
+        self.variants.append(frame_loop)
+        self._select_variant()
+
+    def _select_variant(self):
+        if not self.max_frames_per_second:
+            return
+        budget = self.max_frames_per_second
+        current = self.frame_loop
+        if current.fps * self._rate > budget:
+            fitting = [x for x in self.variants
+                       if x.fps * self._rate <= budget]
+        else:
+            fitting = [x for x in self.variants if x is current
+                       or x.fps * self._rate <= budget * (1.0 - self.switch_margin)]
+        if fitting:
+            best = max(fitting, key=lambda x: x.fps)
+        else:
+            best = min(self.variants, key=lambda x: x.fps)
+        if best is not current:
+            self._advance()
+            self._position_ms %= best.duration_ms
+            self.frame_loop = best
+            self._frame_index = -1
+            metrics.set_gauge("video_fps", best.fps)
+
+    def _advance(self):
+        now_ns = time.monotonic_ns()
+        elapsed_ms = (now_ns - self._clock_ns) / 1e6
+        self._clock_ns = now_ns
+        if self._timer.isActive():
+            self._position_ms = (self._position_ms + elapsed_ms * self._rate) \
+                % self.frame_loop.duration_ms
+
+    @Slot()
+    def _tick(self):
+        self._advance()
+        frame_index = int(self._position_ms * self.frame_loop.fps / 1000.0) \
+            % len(self.frame_loop.frames)
+        if frame_index != self._frame_index and self._output is not None:
+            if self._frame_index < 0:
+                metrics.startup_phase("first_frame")
+            self._frame_index = frame_index
+            self._output.set_frame(self.frame_loop.frames[frame_index])
+
+class FrameLoopWidget(QWidget):
+    """Show frames of a FrameLoopPlayer scaled to the widget."""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._frame = None
+        self._image = None
+        self.setAttribute(Qt.WA_OpaquePaintEvent)
+
+    def setFullScreen(self, fullscreen):
+        if fullscreen:
+            self.showFullScreen()
+        else:
+            self.showNormal()
+
+    def set_frame(self, frame):
+        # The image refers to the frame data, so keep the frame alive
+        self._frame = frame
+        height, width = frame.shape[:2]
+        self._image = QImage(frame.data, width, height, 3 * width,
+                             QImage.Format_RGB888)
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.black)
+        if self._image is None:
+            return
+        size = self._image.size().scaled(self.size(), Qt.KeepAspectRatio)
+        target = QRect(0, 0, size.width(), size.height())
+        target.moveCenter(self.rect().center())
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        painter.drawImage(target, self._image)
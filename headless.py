@@ -0,0 +1,218 @@
+"""Tempo analysis without the GUI.
+
+Captures audio and analyses tempo like the main program, but runs under a
+QCoreApplication without any widgets or video, so it starts quickly, uses
+less memory and works on machines without a display. Settings are read from
+config.JSON.
+
+Each tempo estimate is written as a JSON line with bpm, confidence, beat
+positions in seconds relative to the capture time, capture time as
+monotonic_ns, tier, capture time as wall clock time and wall clock time. Lines go
+to stdout, and to every client of a local socket if --socket is given. With
+--multicast, estimates are also sent to displays following the tempo
+broadcast.
+
+Captured audio can be recorded to a trace with --record, and a trace can be
+analysed again instead of live audio with --replay, at its recorded timing or
+as fast as possible with --max-speed. The program quits when the replay has
+been analysed, and prints the instrumentation summary if instrumentation is
+enabled in the config.
+
+Usage:
+    python headless.py
+    python headless.py --socket gandalf-tempo --quiet
+    python headless.py --multicast --quiet
+    python headless.py --record venue
+    python headless.py --replay venue --max-speed --quiet
+"""
+import argparse
+import json
+import signal
+import sys
+
+from PySide2.QtCore import QCoreApplication, QObject, QTimer, Slot
+from PySide2.QtNetwork import QLocalServer
+
+from analysis_scheduler import AnalysisScheduler
+from audio_device import AudioDevice
+from bpm_helper import BPMQt, BPMmp, supported_sample_rate
+from capture_trace import TraceReplay
+from instrumentation import metrics
+from provisional_tempo import ProvisionalTempo
+from tempo_broadcast import (DEFAULT_GROUP, DEFAULT_PORT, TempoBroadcaster,
+                             tempo_message)
+
+class TempoPublisher(QObject):
+    """Write tempo estimates as JSON lines to a stream and a local socket."""
+    def __init__(self, stream=None, socket_name=None):
+        super().__init__()
+        self.stream = stream
+        self.server = None
+        self.clients = []
+        if socket_name:
+            QLocalServer.removeServer(socket_name)
+            self.server = QLocalServer(self)
+            if not self.server.listen(socket_name):
+                print("Could not listen on socket", socket_name + ":",
+                      self.server.errorString(), file=sys.stderr)
+            self.server.newConnection.connect(self.add_client)
+
+    @Slot()
+    def add_client(self):
+        while self.server.hasPendingConnections():
+            client = self.server.nextPendingConnection()
+            client.disconnected.connect(lambda c=client: self.remove_client(c))
+            self.clients.append(client)
+
+    def remove_client(self, client):
+        if client in self.clients:
+            self.clients.remove(client)
+        client.deleteLater()
+
+    def publish(self, result):
+        line = json.dumps(tempo_message(result)) + "\n"
+        if self.stream:
+            self.stream.write(line)
+            self.stream.flush()
+        data = line.encode("utf-8")
+        for client in self.clients:
+            client.write(data)
+
+    def close(self):
+        for client in self.clients:
+            client.disconnectFromServer()
+        if self.server:
+            self.server.close()
+
+class HeadlessTempo(QObject):
+    """Capture audio, or replay a trace, and publish analysed tempo."""
+    def __init__(self, config, publisher, broadcaster=None, replay=None,
+                 real_time=True):
+        super().__init__()
+        self.publisher = publisher
+        self.broadcaster = broadcaster
+        algorithm = config.get("rhythm_algorithm") or "multifeature"
+        interval_ms = config.get("analysis_interval_ms") or 3000
+        sample_rate = supported_sample_rate(
+            algorithm, config.get("analysis_sample_rate") or 44100)
+        silence_threshold_db = None
+        if config.get("silence_gate", True):
+            silence_threshold_db = config.get("silence_threshold_db") or -60.0
+
+        if replay:
+            self.audio = TraceReplay(replay, sample_rate, silence_threshold_db,
+                                     real_time)
+        else:
+            self.audio = AudioDevice(config.get("default_device", ""),
+                                     interval_ms, sample_rate,
+                                     silence_threshold_db,
+                                     config.get("monitor_all_sources", False),
+                                     config.get("record_trace") or None)
+        if config.get("no_multiprocess"):
+            self.bpm_extractor = BPMQt(
+                self.update_bpm, self.audio.ring_buffer,
+                self.audio.window_size, algorithm=algorithm,
+                max_in_flight=config.get("analysis_threads") or 1)
+        else:
+            self.bpm_extractor = BPMmp(self.update_bpm,
+                                       self.audio.ring_buffer,
+                                       self.audio.window_size,
+                                       algorithm=algorithm)
+        self.scheduler = AnalysisScheduler(
+            self.audio, self.bpm_extractor, interval_ms,
+            config.get("max_analysis_interval_ms") or 12000,
+            config.get("verification_interval_ms") or 10000,
+            config.get("fast_analysis_interval_ms") or 1000,
+            config.get("adaptive_analysis", True))
+        self.audio.data_ready.connect(self.scheduler.audio_ready)
+        self.audio.data_ready.connect(self.bpm_extractor.start_bpm_calculation)
+        self.audio.source_changed.connect(self.source_changed)
+        self.provisional = None
+        if config.get("provisional_tempo", True):
+            self.provisional = ProvisionalTempo(self.update_bpm,
+                                                self.audio.ring_buffer)
+            self.audio.data_ready.connect(self.provisional.audio_ready)
+            self.scheduler.fast_started.connect(self.provisional.start)
+        self.audio.start()
+
+    @Slot(str)
+    def source_changed(self, name):
+        self.bpm_extractor.set_ring_buffer(self.audio.ring_buffer)
+        if self.provisional:
+            self.provisional.set_ring_buffer(self.audio.ring_buffer)
+        self.scheduler.source_changed(name)
+
+    def update_bpm(self, bpm, result):
+        if result.tier == "full":
+            self.scheduler.estimate(bpm)
+            if self.provisional:
+                self.provisional.confirm()
+        self.publisher.publish(result)
+        if self.broadcaster:
+            self.broadcaster.publish(result)
+
+    def stop(self):
+        self.bpm_extractor.stop()
+        self.audio.stop()
+        self.publisher.close()
+        if self.broadcaster:
+            self.broadcaster.close()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Analyse tempo of captured audio without the GUI.")
+    parser.add_argument("--config", default="config.JSON")
+    parser.add_argument("--device", help="Audio input device name.")
+    parser.add_argument("--socket", help="Name of local socket to publish on.")
+    parser.add_argument("--quiet", action="store_true",
+                        help="Do not write estimates to stdout.")
+    parser.add_argument("--multicast", action="store_true",
+                        help="Send estimates to the tempo broadcast group.")
+    parser.add_argument("--record", help="Record captured audio to a trace.")
+    parser.add_argument("--replay", help="Analyse a trace instead of audio.")
+    parser.add_argument("--max-speed", action="store_true",
+                        help="Replay the trace as fast as possible.")
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config = json.load(config_file)
+    if args.device:
+        config["default_device"] = args.device
+    if args.record:
+        config["record_trace"] = args.record
+    metrics.enable(config.get("instrumentation", False))
+
+    app = QCoreApplication(sys.argv)
+    app.setApplicationName("Gandalf Enjoys Music")
+
+    publisher = TempoPublisher(None if args.quiet else sys.stdout, args.socket)
+    broadcaster = None
+    if args.multicast:
+        broadcaster = TempoBroadcaster(
+            config.get("broadcast_group") or DEFAULT_GROUP,
+            config.get("broadcast_port") or DEFAULT_PORT)
+    tempo = HeadlessTempo(config, publisher, broadcaster, args.replay,
+                          not args.max_speed)
+    app.aboutToQuit.connect(tempo.stop)
+    if args.replay:
+        idle_timer = QTimer()
+        idle_timer.setInterval(50)
+        def quit_when_idle():
+            if tempo.bpm_extractor.in_flight == 0:
+                if metrics.enabled:
+                    print(metrics.summary(), file=sys.stderr)
+                app.quit()
+        idle_timer.timeout.connect(quit_when_idle)
+        tempo.audio.finished.connect(idle_timer.start)
+
+    signal.signal(signal.SIGINT, lambda *_: app.quit())
+    signal.signal(signal.SIGTERM, lambda *_: app.quit())
+    # Let the Python interpreter run signal handlers during the event loop
+    signal_timer = QTimer()
+    signal_timer.timeout.connect(lambda: None)
+    signal_timer.start(200)
+
+    sys.exit(app.exec_())
+
+if __name__ == "__main__":
+    main()
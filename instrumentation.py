@@ -0,0 +1,187 @@
+"""Timing instrumentation for the capture, analysis and playback pipeline.
+
+Stages are timed with monotonic timestamps and collected into histograms.
+Instrumentation is disabled by default, in which case now() returns 0 and all
+recording methods return immediately, so the calls can stay in the hot path.
+
+Usage:
+    start = metrics.now()
+    ...
+    metrics.record("stage_name", start)
+
+Start up phases are always recorded, as time from import of this module,
+which is the first thing the program does.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+class Histogram():
+    """Histogram of durations with power of two microsecond buckets."""
+    bucket_count = 28
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.buckets = [0] * self.bucket_count
+
+    def add(self, duration_ns):
+        duration_ns = max(duration_ns, 0)
+        self.count += 1
+        self.total_ns += duration_ns
+        self.max_ns = max(self.max_ns, duration_ns)
+        index = min((duration_ns // 1000).bit_length(), self.bucket_count - 1)
+        self.buckets[index] += 1
+
+    def percentile(self, percent):
+        """Return upper bound of the bucket holding percentile in ms."""
+        limit = self.count * percent / 100.0
+        total = 0
+        for index, amount in enumerate(self.buckets):
+            total += amount
+            if total >= limit and amount:
+                return (1 << index) / 1000.0
+        return 0.0
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.total_ns / self.count / 1e6 if self.count else 0.0,
+            "max_ms": self.max_ns / 1e6,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "buckets_us": self.buckets,
+        }
+
+STARTED_NS = time.monotonic_ns()
+
+class Instrumentation():
+    """Collect stage timings, counters and gauges.
+
+    Windows are identified by the ring buffer write index at the end of the
+    window. The capture time of the latest windows is kept, so that the time
+    from capture to later stages can be recorded.
+
+    Stages are recorded from thread pool threads too, so the collected data
+    is only accessed while holding a lock.
+    """
+    max_tracked_windows = 32
+
+    def __init__(self):
+        self.enabled = False
+        self.startup = OrderedDict()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.counters = {}
+            self.gauges = {}
+            self._windows = OrderedDict()
+            self.started_ns = time.monotonic_ns()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+        self.reset()
+
+    def now(self):
+        """Return monotonic timestamp in ns, or 0 if disabled."""
+        if not self.enabled:
+            return 0
+        return time.monotonic_ns()
+
+    def record(self, stage, start_ns, end_ns=None):
+        """Record duration of stage from start_ns to end_ns or now."""
+        if not self.enabled:
+            return
+        if end_ns is None:
+            end_ns = time.monotonic_ns()
+        self.record_duration(stage, end_ns - start_ns)
+
+    def record_duration(self, stage, duration_ns):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.add(duration_ns)
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.gauges[name] = value
+
+    def startup_phase(self, name):
+        """Record time of reaching a start up phase the first time."""
+        with self._lock:
+            if name not in self.startup:
+                self.startup[name] = (time.monotonic_ns() - STARTED_NS) / 1e6
+
+    def startup_report(self):
+        """Return start up phases in order of time, in ms from start."""
+        with self._lock:
+            phases = sorted(self.startup.items(), key=lambda x: x[1])
+        return "\n".join("{}: {:.0f} ms".format(name, time_ms)
+                         for name, time_ms in phases)
+
+    def window_captured(self, end, timestamp_ns):
+        """Store capture time of window ending at ring buffer index end."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._windows[end] = timestamp_ns
+            while len(self._windows) > self.max_tracked_windows:
+                self._windows.popitem(last=False)
+
+    def record_window(self, stage, end, timestamp_ns=None):
+        """Record time from capture of window to timestamp_ns or now."""
+        if not self.enabled:
+            return
+        with self._lock:
+            captured_ns = self._windows.get(end)
+        if captured_ns is not None:
+            self.record(stage, captured_ns, timestamp_ns)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "time": time.time(),
+                "uptime_s": (time.monotonic_ns() - self.started_ns) / 1e9,
+                "stages": {name: histogram.to_dict()
+                           for name, histogram in self.histograms.items()},
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "startup_ms": dict(self.startup),
+            }
+
+    def write_json_line(self, path):
+        """Append a snapshot to a JSON lines log file."""
+        with open(path, "a", encoding="utf-8") as log_file:
+            log_file.write(json.dumps(self.snapshot()) + "\n")
+
+    def summary(self):
+        """Return a short text summary for on-screen display."""
+        snapshot = self.snapshot()
+        lines = []
+        for name, stats in sorted(snapshot["stages"].items()):
+            lines.append("{}: {:.1f} ms (p95 {:.1f}, max {:.1f}, n {})".format(
+                name, stats["mean_ms"], stats["p95_ms"], stats["max_ms"],
+                stats["count"]))
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append("{}: {}".format(name, value))
+        for name, value in sorted(snapshot["gauges"].items()):
+            lines.append("{}: {}".format(name, value))
+        return "\n".join(lines)
+
+metrics = Instrumentation()
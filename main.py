@@ -12,10 +12,15 @@ Date: 21.5.2020
 
 import sys
 
+# Imported first, start up phases are timed from here
+from instrumentation import metrics
+
 from PySide2.QtWidgets import QApplication
 
 from mainwindow import MainWindow
 
+metrics.startup_phase("imports")
+
 def main():
     app = QApplication(sys.argv)
     app.setApplicationName("Gandalf Enjoys Music")
@@ -1,96 +1,193 @@
 import os
 import json
 import math
+import subprocess
+import threading
+import time
 
-import pydbus
-import gi.repository
-
-from PySide2.QtCore import Qt, QUrl, Signal, Slot, QSize
-from PySide2.QtGui import QPalette, QIcon, QPixmap
-from PySide2.QtMultimedia import QMediaPlayer, QMediaPlaylist
-from PySide2.QtMultimediaWidgets import QVideoWidget
+from PySide2.QtCore import Qt, QUrl, Signal, Slot, QSize, QTimer
+from PySide2.QtGui import QPalette, QIcon, QPixmap, QFontDatabase
 from PySide2.QtWidgets import (QApplication, QCheckBox, QComboBox, QHBoxLayout, QLabel,
                                QLineEdit, QMainWindow, QPushButton,
                                QVBoxLayout, QWidget)
 
+from analysis_scheduler import AnalysisScheduler
 from audio_device import AudioDevice
-from bpm_helper import BPMQt, BPMmp
-
-
-class VideoWidget(QVideoWidget):
-    fullscreen_changed = Signal(bool)
-    def __init__(self, parent, show_preview, screen):
-        super().__init__(parent)
-        self.show_preview = show_preview
-        self.screen = screen
-
-        self.pal = self.palette()
-        self.pal.setColor(QPalette.Background, Qt.black)
-        self.setAutoFillBackground(True)
-        self.setPalette(self.pal)
+from bpm_helper import BPMQt, BPMmp, supported_sample_rate
+from capture_trace import TraceReplay
+from frame_loop import FrameLoop, FrameLoopPlayer
+from instrumentation import metrics
+from mpris_watcher import MprisWatcher
+from phase_lock import BeatPhaseLock
+from provisional_tempo import ProvisionalTempo
+from tempo_broadcast import (DEFAULT_GROUP, DEFAULT_PORT, TempoBroadcaster,
+                             TempoFollower)
+from tempo_cache import (CachedTempo, TempoCache, TempoConvergence,
+                         octave_between)
+from tempo_tracker import TempoTracker
+from track_prefetcher import TrackPrefetcher
+from video_widgets import FrameVideoWidget
 
-        self.desktop = QApplication.desktop()
-
-    def mouseDoubleClickEvent(self, event):
-        if self.isFullScreen():
-            if self.show_preview:
-                self.setFullScreen(False)
-            else:
-                self.hide()
-            self.fullscreen_changed.emit(False)
-        else:
-            self.setFullScreen(True)
-            self.setGeometry(self.desktop.screenGeometry(self.screen))
-            self.fullscreen_changed.emit(True)
-
-    def keyPressEvent(self, event):
-        if event.key() == Qt.Key_Escape:
-            if self.show_preview:
-                self.setFullScreen(False)
-            else:
-                self.hide()
-            self.fullscreen_changed.emit(False)
 
 class MainWindow(QMainWindow):
     """Display video loop and controls"""
     audio_changed = Signal(str)
+    frame_loop_ready = Signal(object)
     def __init__(self, parent=None):
         super().__init__(parent)
 
         # Default values. Updated if found in config.JSON
         self.use_qt_thread = False
+        self.analysis_threads = 1
         self.rhythm_algorithm = "multifeature"
+        self.analysis_interval_ms = 3000
+        self.analysis_sample_rate = 44100
+        self.silence_gate = True
+        self.silence_threshold_db = -60.0
         self.default_device_name = ""
+        self.monitor_all_sources = False
+        self.record_trace = ""
+        self.replay_trace = ""
         self.show_video_preview = True
         self.video_loop_bpm = 60
         self.video_update_skip_ms = 100
+        self.video_renderer = "frame_loop"
+        self.frame_loop_height = 480
+        self.frame_loop_frame_rates = [15, 60]
+        self.max_frames_per_second = 60
+        self.beat_phase_lock = True
+        self.video_beat_offset_ms = 0
+        self.phase_lock_interval_ms = 500
         self.limit_tempo_by_default = False
         self.tempo_lower_limit = 60.0
         self.tempo_upper_limit = 120.0
         self.screen = 0
-
-        self.spotify_track_id = ""
+        self.instrumentation = False
+        self.instrumentation_log = ""
+        self.instrumentation_overlay = False
+        self.instrumentation_interval_ms = 5000
+        self.startup_report = False
+        self.tempo_cache_file = "tempo_cache.sqlite"
+        self.verification_interval_ms = 10000
+        self.adaptive_analysis = True
+        self.provisional_tempo = True
+        self.max_analysis_interval_ms = 12000
+        self.fast_analysis_interval_ms = 1000
+        self.prefetch_tracks = 3
+        self.prefetch_processes = 1
+        self.tempo_broadcast = ""
+        self.broadcast_group = DEFAULT_GROUP
+        self.broadcast_port = DEFAULT_PORT
+
+        self.track_key = ""
+        self.cached_tempo = None
+        self.phase_lock = BeatPhaseLock()
+        self.phase_correction = 1.0
 
         self.read_config()
 
+        metrics.enable(self.instrumentation)
+
+        self.tempo_cache = None
+        if self.tempo_cache_file:
+            self.tempo_cache = TempoCache(self.tempo_cache_file)
+        self.convergence = TempoConvergence()
+        self.tempo_tracker = TempoTracker(self.tempo_lower_limit,
+                                          self.tempo_upper_limit)
+
+        self.prefetcher = None
+        if self.tempo_cache and self.prefetch_tracks > 0 \
+                and self.tempo_broadcast != "follow":
+            self.prefetcher = TrackPrefetcher(
+                self.tempo_cache, self.rhythm_algorithm,
+                self.analysis_sample_rate, self.prefetch_processes)
+            self.prefetcher.analysed.connect(self.track_analysed)
+
+        self.mpris = MprisWatcher(self.prefetch_tracks if self.prefetcher
+                                  else 0)
+        self.mpris.track_changed.connect(self.track_changed)
+        if self.prefetcher:
+            self.mpris.upcoming_tracks.connect(self.prefetcher.prefetch)
+
         self.setWindowTitle("Gandalf Enjoys Music")
         self.desktop = QApplication.desktop()
 
-        self.audio = AudioDevice(self.default_device_name)
-        self.input_devices = self.audio.get_input_device_names()
+        self.broadcaster = None
+        self.follower = None
+        self.audio = None
+        self.bpm_extractor = None
+        self.scheduler = None
+        self.provisional = None
+        self.input_devices = []
+        if self.tempo_broadcast == "follow":
+            # Tempo comes from the network, so no audio is captured
+            self.follower = TempoFollower(self.broadcast_group,
+                                          self.broadcast_port)
+            self.follower.tempo.connect(self.follow_tempo)
+        else:
+            if self.tempo_broadcast == "send":
+                self.broadcaster = TempoBroadcaster(self.broadcast_group,
+                                                    self.broadcast_port)
+            self.init_audio()
+        # Started only after the analysis worker process has been forked, as
+        # forking a process with running threads is not safe
+        self.mpris.start()
+
+        self.init_ui()
+        metrics.startup_phase("window_created")
+
+        if self.audio:
+            # Start capturing audio after the window has been shown
+            QTimer.singleShot(0, self.audio.start)
+
+    def init_audio(self):
+        """Create audio capture and tempo analysis."""
+        sample_rate = supported_sample_rate(self.rhythm_algorithm,
+                                            self.analysis_sample_rate)
+        silence_threshold_db = None
+        if self.silence_gate:
+            silence_threshold_db = self.silence_threshold_db
+        if self.replay_trace:
+            self.audio = TraceReplay(self.replay_trace, sample_rate,
+                                     silence_threshold_db)
+        else:
+            self.audio = AudioDevice(self.default_device_name,
+                                     self.analysis_interval_ms,
+                                     sample_rate,
+                                     silence_threshold_db,
+                                     self.monitor_all_sources,
+                                     self.record_trace or None)
 
         self.audio_changed.connect(self.audio.change_audio_input)
 
         if self.use_qt_thread:
             self.bpm_extractor = BPMQt(self.update_bpm,
-                                       algorithm=self.rhythm_algorithm)
+                                       self.audio.ring_buffer,
+                                       self.audio.window_size,
+                                       algorithm=self.rhythm_algorithm,
+                                       max_in_flight=self.analysis_threads)
         else:
             self.bpm_extractor = BPMmp(self.update_bpm,
+                                       self.audio.ring_buffer,
+                                       self.audio.window_size,
                                        algorithm=self.rhythm_algorithm)
 
+        self.scheduler = AnalysisScheduler(self.audio, self.bpm_extractor,
+                                           self.analysis_interval_ms,
+                                           self.max_analysis_interval_ms,
+                                           self.verification_interval_ms,
+                                           self.fast_analysis_interval_ms,
+                                           self.adaptive_analysis)
+        self.audio.data_ready.connect(self.scheduler.audio_ready)
         self.audio.data_ready.connect(self.bpm_extractor.start_bpm_calculation)
+        self.audio.audio_inputs.connect(self.update_audio_inputs)
+        self.audio.source_changed.connect(self.source_changed)
 
-        self.init_ui()
+        if self.provisional_tempo:
+            self.provisional = ProvisionalTempo(self.update_bpm,
+                                                self.audio.ring_buffer)
+            self.audio.data_ready.connect(self.provisional.audio_ready)
+            self.scheduler.fast_started.connect(self.provisional.start)
 
     def init_ui(self):
         dir_path = os.path.dirname(os.path.realpath(__file__))
@@ -123,12 +220,8 @@ class MainWindow(QMainWindow):
             self.fullscreen_button.setText("Go Fullscreen")
             self.layout.addWidget(self.fullscreen_button)
             self.fullscreen_button.clicked.connect(self.show_fullscreen)
-            self.video_widget.fullscreen_changed.connect(
-                self.update_button_text)
 
-        self.video_widget.fullscreen_changed.connect(
-            self.reset_video_position
-        )
+        self.connect_video_widget()
 
         self.tempo_control_layout = QVBoxLayout()
         self.tempo_control_layout.addWidget(self.lock_checkbox)
@@ -175,15 +268,93 @@ class MainWindow(QMainWindow):
 
         self.audio_selection = QComboBox(self)
         self.audio_selection.addItems(self.input_devices)
+        if self.follower:
+            self.audio_select_label.setText("Following tempo broadcast")
+            self.audio_selection.hide()
         self.audio_selection.currentIndexChanged.connect(self.audio_selection_changed)
         self.device_layout.addWidget(self.audio_selection)
 
         self.layout.addLayout(self.device_layout)
 
+        if self.instrumentation:
+            self.init_instrumentation()
+
         self.central.setLayout(self.layout)
 
+    def init_instrumentation(self):
+        """Write timing statistics to log and overlay periodically."""
+        self.instrumentation_label = None
+        if self.instrumentation_overlay:
+            self.instrumentation_label = QLabel(self.video_widget)
+            self.instrumentation_label.setFont(
+                QFontDatabase.systemFont(QFontDatabase.FixedFont))
+            self.instrumentation_label.setStyleSheet(
+                "color: white; background-color: rgba(0, 0, 0, 160);")
+            self.instrumentation_label.move(5, 5)
+
+        self.instrumentation_timer = QTimer(self)
+        self.instrumentation_timer.setInterval(self.instrumentation_interval_ms)
+        self.instrumentation_timer.timeout.connect(self.update_instrumentation)
+        self.instrumentation_timer.start()
+
+    @Slot()
+    def update_instrumentation(self):
+        if self.instrumentation_log:
+            metrics.write_json_line(self.instrumentation_log)
+        if self.instrumentation_label:
+            self.instrumentation_label.setText(metrics.summary())
+            self.instrumentation_label.adjustSize()
+
     def init_video(self):
         self.old_bpm = 1.0
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+
+        self.frame_loop = None
+        self.video_path = dir_path + "/resources/video.mp4"
+        if self.video_renderer == "frame_loop":
+            try:
+                self.frame_loop = FrameLoop(self.video_path,
+                                            self.frame_loop_height,
+                                            decode=False)
+            except FileNotFoundError:
+                # First decode takes a while, media player plays meanwhile
+                self.frame_loop_ready.connect(self.use_frame_loop)
+                threading.Thread(target=self.decode_frame_loop,
+                                 daemon=True).start()
+
+        if self.frame_loop:
+            self.init_frame_loop_player()
+        else:
+            self.init_media_player(dir_path)
+
+        self.media_player.play()
+
+        self.change_playback_rate(self.video_loop_bpm)
+
+        if self.beat_phase_lock:
+            self.phase_lock_timer = QTimer(self)
+            self.phase_lock_timer.setInterval(self.phase_lock_interval_ms)
+            self.phase_lock_timer.timeout.connect(self.apply_phase_correction)
+            self.phase_lock_timer.start()
+
+        if not self.show_video_preview:
+            self.video_widget.hide()
+
+    def init_frame_loop_player(self):
+        self.video_widget = FrameVideoWidget(self,
+                                             self.show_video_preview,
+                                             self.screen)
+        self.media_player = FrameLoopPlayer(self.frame_loop, self.central,
+                                            self.max_frames_per_second)
+        self.media_player.setVideoOutput(self.video_widget)
+        if self.frame_loop_frame_rates and self.max_frames_per_second:
+            self.media_player.load_variants(self.video_path,
+                                            self.frame_loop_height,
+                                            self.frame_loop_frame_rates)
+
+    def init_media_player(self, dir_path):
+        from PySide2.QtMultimedia import QMediaPlayer, QMediaPlaylist
+        from media_video_widget import VideoWidget
 
         self.video_widget = VideoWidget(self,
                                         self.show_video_preview,
@@ -192,45 +363,89 @@ class MainWindow(QMainWindow):
         self.media_player.setVideoOutput(self.video_widget)
 
         self.playlist = QMediaPlaylist(self.media_player)
-        dir_path = os.path.dirname(os.path.realpath(__file__))
         file_location = dir_path + "/resources/video_long.mp4"
         self.video_file = QUrl.fromLocalFile(file_location)
         self.playlist.addMedia(self.video_file)
         self.playlist.setPlaybackMode(QMediaPlaylist.Loop)
         self.playlist.setCurrentIndex(0)
         self.media_player.setPlaylist(self.playlist)
-        self.media_player.mediaStatusChanged.connect(self.handle_media_state_changed)
+        self.media_player.mediaStatusChanged.connect(
+            self.handle_media_state_changed)
 
+    def decode_frame_loop(self):
+        """Decode the video loop, run in a background thread."""
+        try:
+            frame_loop = FrameLoop(self.video_path, self.frame_loop_height)
+        except (OSError, subprocess.CalledProcessError) as err:
+            print("Could not decode video loop, using media player:", err)
+            return
+        self.frame_loop_ready.emit(frame_loop)
+
+    @Slot(object)
+    def use_frame_loop(self, frame_loop):
+        """Switch from the media player to the decoded video loop."""
+        old_widget = self.video_widget
+        old_player = self.media_player
+        fullscreen = old_widget.isFullScreen()
+
+        self.frame_loop = frame_loop
+        self.init_frame_loop_player()
+        self.layout.replaceWidget(old_widget, self.video_widget)
+        self.connect_video_widget()
+        if self.instrumentation and self.instrumentation_label:
+            self.instrumentation_label.setParent(self.video_widget)
+            self.instrumentation_label.show()
+
+        old_player.stop()
+        old_widget.hide()
+        old_player.deleteLater()
+        old_widget.deleteLater()
+
+        self.media_player.setPlaybackRate(self.old_bpm / self.video_loop_bpm
+                                          * self.phase_correction)
         self.media_player.play()
+        if fullscreen:
+            self.video_widget.setFullScreen(True)
+            self.video_widget.setGeometry(
+                self.desktop.screenGeometry(self.screen))
+        elif not self.show_video_preview:
+            self.video_widget.hide()
 
-        self.change_playback_rate(self.video_loop_bpm)
-
+    def connect_video_widget(self):
         if not self.show_video_preview:
-            self.video_widget.hide()
+            self.video_widget.fullscreen_changed.connect(
+                self.update_button_text)
+        self.video_widget.fullscreen_changed.connect(
+            self.reset_video_position
+        )
 
     def handle_media_state_changed(self, state):
+        from PySide2.QtMultimedia import QMediaPlayer
+
         if state == QMediaPlayer.MediaStatus.BufferedMedia:
+            metrics.startup_phase("first_frame")
             playback_speed = self.old_bpm / self.video_loop_bpm
-            self.media_player.setPlaybackRate(playback_speed)
+            self.media_player.setPlaybackRate(playback_speed
+                                              * self.phase_correction)
             self.media_player.setPosition(0)
 
     def change_playback_rate(self, bpm):
         """Update playback speed for video loop."""
         if bpm != self.old_bpm:
-            # Prevent switching between double and half tempo during the same song in spotify
-            track_id = get_spotify_track()
-            if not self.lock_checkbox.isChecked()\
-                    and not self.limit_checkbox.isChecked()\
-                    and (math.isclose(bpm*2,self.old_bpm, rel_tol=3e-2)\
-                    or math.isclose(bpm, self.old_bpm*2, rel_tol=3e-2))\
-                    and track_id and track_id == self.spotify_track_id:
-                self.spotify_track_id = track_id
-                return
-            self.spotify_track_id = track_id
-            
+            start = metrics.now()
+            self.track_key = self.mpris.track_key
+
             self.old_bpm = bpm
             playback_speed = bpm / self.video_loop_bpm
 
+            if self.frame_loop or self.beat_phase_lock:
+                # Frame loop changes rate smoothly, and phase lock corrects
+                # phase with small rate changes, so no seeking is needed
+                self.media_player.setPlaybackRate(playback_speed
+                                                  * self.phase_correction)
+                metrics.record("playback_rate", start)
+                return
+
             # Workaround for a bug which causes irregular video playback speed
             # after changing playback rate
             current_position = self.media_player.position()
@@ -238,19 +453,141 @@ class MainWindow(QMainWindow):
             self.media_player.setPosition(current_position
                                           + self.video_update_skip_ms
                                           * playback_speed)
+            metrics.record("playback_rate", start)
 
-    def update_bpm(self, bpm, manual=False):
+    @Slot()
+    def apply_phase_correction(self):
+        """Nudge playback rate so that nods of the video land on beats."""
+        playback_speed = self.old_bpm / self.video_loop_bpm
+        correction = self.phase_lock.correction(
+            time.monotonic_ns(), self.media_player.position(), playback_speed,
+            60000.0 / self.video_loop_bpm, self.video_beat_offset_ms)
+        if correction is None:
+            correction = 1.0
+        if correction != self.phase_correction:
+            self.phase_correction = correction
+            self.media_player.setPlaybackRate(playback_speed * correction)
+            metrics.set_gauge("phase_correction", correction)
+
+    def update_bpm(self, bpm, result=None, manual=False):
+        analysed_bpm = bpm
         if not manual:
+            if "first_bpm" not in metrics.startup:
+                metrics.startup_phase("first_bpm")
+                if self.startup_report:
+                    print("Start up times:")
+                    print(metrics.startup_report())
             if self.lock_checkbox.isChecked():
                 return
-            bpm = float(int(bpm+0.5))
-        if self.limit_checkbox.isChecked():
-            while bpm < self.tempo_lower_limit:
-                bpm = bpm * 2.0
-            while bpm > self.tempo_upper_limit:
-                bpm = bpm / 2.0
-        self.change_playback_rate(bpm)
-        self.set_bpm_widget.setText("{:.1f}".format(self.old_bpm))
+            if result is not None and self.broadcaster:
+                self.broadcaster.publish(result)
+            if result is not None and result.tier == "provisional":
+                self.apply_provisional_tempo(bpm)
+                return
+            if self.provisional:
+                self.provisional.confirm()
+            if self.cached_tempo and self.verify_cached_tempo(bpm):
+                self.update_phase_lock(result, self.cached_tempo.bpm
+                                       / 2.0 ** self.cached_tempo.octave)
+                return
+            confidence = result.confidence if result is not None else 0.0
+            evidence = result.octave_evidence if result is not None else ()
+            bpm = self.tempo_tracker.add(bpm, confidence, evidence)
+            self.update_phase_lock(result, self.tempo_tracker.bpm)
+        if bpm is not None:
+            if not manual:
+                bpm = float(int(bpm+0.5))
+            if self.limit_checkbox.isChecked():
+                while bpm < self.tempo_lower_limit:
+                    bpm = bpm * 2.0
+                while bpm > self.tempo_upper_limit:
+                    bpm = bpm / 2.0
+            if manual:
+                self.tempo_tracker.reset(bpm)
+            self.change_playback_rate(bpm)
+            self.set_bpm_widget.setText("{:.1f}".format(self.old_bpm))
+        if not manual:
+            if self.scheduler:
+                self.scheduler.estimate(analysed_bpm)
+            self.store_converged_tempo(analysed_bpm)
+
+    def update_phase_lock(self, result, accepted_bpm):
+        """Update beat grid with a result agreeing with the accepted tempo.
+
+        Outliers and half or double tempo estimates which the tempo tracker
+        does not accept would otherwise move the beat grid.
+        """
+        if result is None or not accepted_bpm:
+            return
+        if math.isclose(result.bpm, accepted_bpm,
+                        rel_tol=TempoTracker.tolerance):
+            self.phase_lock.update(result)
+
+    def apply_provisional_tempo(self, bpm):
+        """Show quick estimate until the full analysis has a result."""
+        if self.cached_tempo or self.tempo_tracker.history:
+            return
+        metrics.count("provisional_tempos")
+        self.update_bpm(float(int(bpm+0.5)), manual=True)
+
+    @Slot(object)
+    def follow_tempo(self, result):
+        """Apply tempo received from the tempo broadcast."""
+        if 0 < result.bpm < 300:
+            self.update_bpm(result.bpm, result)
+
+    @Slot(str)
+    def track_changed(self, track_key):
+        """Apply cached tempo of the new track and only verify it after that."""
+        self.convergence.reset()
+        self.phase_lock.reset()
+        self.tempo_tracker.reset()
+        self.cached_tempo = None
+        if self.tempo_cache and track_key:
+            self.cached_tempo = self.tempo_cache.get(track_key)
+        if self.cached_tempo and not self.lock_checkbox.isChecked():
+            self.update_bpm(self.cached_tempo.bpm, manual=True)
+            if self.scheduler:
+                self.scheduler.verify_only()
+        elif self.scheduler:
+            self.scheduler.track_changed(track_key)
+
+    @Slot(str)
+    def track_analysed(self, track_key):
+        """Apply tempo of the playing track when its prefetch finishes late."""
+        if track_key == self.mpris.track_key and not self.cached_tempo:
+            self.track_changed(track_key)
+
+    def verify_cached_tempo(self, bpm):
+        """Check analysed tempo against cached tempo of the current track.
+
+        Returns True if the estimate agrees with the cached tempo, or has not
+        yet converged to a different tempo. In that case the estimate is not
+        applied. A converged different tempo replaces the cached one.
+        """
+        cached_bpm = self.cached_tempo.bpm / 2.0 ** self.cached_tempo.octave
+        if math.isclose(bpm, cached_bpm, rel_tol=TempoConvergence.tolerance):
+            return True
+        if self.convergence.add(bpm) is None:
+            return True
+        self.cached_tempo = None
+        self.convergence.reset()
+        if self.scheduler:
+            self.scheduler.start_fast()
+        return False
+
+    def store_converged_tempo(self, bpm):
+        """Store tempo of current track in cache when estimates agree."""
+        converged_bpm = self.convergence.add(bpm)
+        if converged_bpm is None or not self.tempo_cache:
+            return
+        track_key = self.mpris.track_key
+        if track_key and track_key == self.track_key:
+            self.cached_tempo = CachedTempo(
+                self.old_bpm, self.convergence.confidence,
+                octave_between(self.old_bpm, converged_bpm))
+            self.tempo_cache.put(track_key, *self.cached_tempo)
+            self.convergence.reset()
 
     def update_bpm_manually(self):
         bpm = self.set_bpm_widget.text()
@@ -260,7 +597,8 @@ class MainWindow(QMainWindow):
                 raise ValueError
         except ValueError:
             return
-        self.spotify_track_id = ""
+        self.track_key = ""
+        self.phase_lock.reset()
         self.update_bpm(bpm, manual=True)
 
     def update_lock_checkbox(self):
@@ -288,6 +626,7 @@ class MainWindow(QMainWindow):
             self.tempo_lower_limit = value
         else:
             self.tempo_lower_limit = self.tempo_upper_limit / 2.0
+        self.tempo_tracker.lower = self.tempo_lower_limit
         self.lower_bpm_widget.setText("{:.1f}".format(self.tempo_lower_limit))
 
     def update_upper_limit(self, value=None):
@@ -303,8 +642,34 @@ class MainWindow(QMainWindow):
             self.tempo_upper_limit = value
         else:
             self.tempo_upper_limit = self.tempo_lower_limit * 2.0
+        self.tempo_tracker.upper = self.tempo_upper_limit
         self.upper_bpm_widget.setText("{:.1f}".format(self.tempo_upper_limit))
 
+    @Slot(object)
+    def update_audio_inputs(self, names):
+        """Fill audio device selection when audio devices are listed."""
+        metrics.startup_phase("audio_started")
+        self.input_devices = names
+        self.audio_selection.blockSignals(True)
+        self.audio_selection.clear()
+        self.audio_selection.addItems(names)
+        if self.audio.automatic and AudioDevice.automatic_name in names:
+            self.audio_selection.setCurrentText(AudioDevice.automatic_name)
+        else:
+            self.audio_selection.setCurrentText(self.audio.active.name)
+        self.audio_selection.blockSignals(False)
+
+    @Slot(str)
+    def source_changed(self, name):
+        """Analyse the new audio source from its own ring buffer."""
+        self.bpm_extractor.set_ring_buffer(self.audio.ring_buffer)
+        if self.provisional:
+            self.provisional.set_ring_buffer(self.audio.ring_buffer)
+        self.scheduler.source_changed(name)
+        self.phase_lock.reset()
+        self.convergence.reset()
+        self.tempo_tracker.reset()
+
     def audio_selection_changed(self, idx):
         self.audio_changed.emit(self.audio_selection.currentText())
 
@@ -330,22 +695,69 @@ class MainWindow(QMainWindow):
         else:
             self.fullscreen_button.setText("Go Fullscreen")
 
+    def closeEvent(self, event):
+        if self.audio:
+            self.bpm_extractor.stop()
+            self.audio.stop()
+        if self.broadcaster:
+            self.broadcaster.close()
+        if self.follower:
+            self.follower.close()
+        self.mpris.stop()
+        if self.prefetcher:
+            self.prefetcher.stop()
+        if self.tempo_cache:
+            self.tempo_cache.close()
+        super().closeEvent(event)
+
     def read_config(self):
         with open("config.JSON") as config_file:
             config = json.load(config_file)
 
             if "no_multiprocess" in config:
                 self.use_qt_thread = config["no_multiprocess"]
+            if config.get("analysis_threads"):
+                self.analysis_threads = config["analysis_threads"]
             if config.get("rhythm_algorithm_faster"):
                 self.rhythm_algorithm = "degara"
+            if config.get("rhythm_algorithm"):
+                self.rhythm_algorithm = config["rhythm_algorithm"]
+            if config.get("analysis_interval_ms"):
+                self.analysis_interval_ms = config["analysis_interval_ms"]
+            if config.get("analysis_sample_rate"):
+                self.analysis_sample_rate = config["analysis_sample_rate"]
+            if "silence_gate" in config:
+                self.silence_gate = config["silence_gate"]
+            if config.get("silence_threshold_db"):
+                self.silence_threshold_db = config["silence_threshold_db"]
             if config.get("default_device"):
                 self.default_device_name = config["default_device"]
+            if "monitor_all_sources" in config:
+                self.monitor_all_sources = config["monitor_all_sources"]
+            if "record_trace" in config:
+                self.record_trace = config["record_trace"]
+            if "replay_trace" in config:
+                self.replay_trace = config["replay_trace"]
             if "show_video_preview" in config:
                 self.show_video_preview = config.get("show_video_preview")
             if config.get("video_loop_bpm"):
                 self.video_loop_bpm = config["video_loop_bpm"]
             if config.get("video_update_skip_time_ms"):
                 self.video_update_skip_ms = config["video_update_skip_time_ms"]
+            if config.get("video_renderer"):
+                self.video_renderer = config["video_renderer"]
+            if "frame_loop_height" in config:
+                self.frame_loop_height = config["frame_loop_height"]
+            if "frame_loop_frame_rates" in config:
+                self.frame_loop_frame_rates = config["frame_loop_frame_rates"]
+            if "max_frames_per_second" in config:
+                self.max_frames_per_second = config["max_frames_per_second"]
+            if "beat_phase_lock" in config:
+                self.beat_phase_lock = config["beat_phase_lock"]
+            if "video_beat_offset_ms" in config:
+                self.video_beat_offset_ms = config["video_beat_offset_ms"]
+            if config.get("phase_lock_interval_ms"):
+                self.phase_lock_interval_ms = config["phase_lock_interval_ms"]
             if config.get("limit_tempo_by_default"):
                 self.limit_tempo_by_default = config["limit_tempo_by_default"]
             if config.get("tempo_lower_limit"):
@@ -354,44 +766,96 @@ class MainWindow(QMainWindow):
                 self.tempo_upper_limit = config["tempo_upper_limit"]
             if "screen" in config:
                 self.screen = config["screen"]
+            if "tempo_cache_file" in config:
+                self.tempo_cache_file = config["tempo_cache_file"]
+            if config.get("verification_interval_ms"):
+                self.verification_interval_ms = config["verification_interval_ms"]
+            if "adaptive_analysis" in config:
+                self.adaptive_analysis = config["adaptive_analysis"]
+            if "provisional_tempo" in config:
+                self.provisional_tempo = config["provisional_tempo"]
+            if config.get("max_analysis_interval_ms"):
+                self.max_analysis_interval_ms = config["max_analysis_interval_ms"]
+            if config.get("fast_analysis_interval_ms"):
+                self.fast_analysis_interval_ms = config["fast_analysis_interval_ms"]
+            if config.get("instrumentation"):
+                self.instrumentation = config["instrumentation"]
+            if config.get("instrumentation_log"):
+                self.instrumentation_log = config["instrumentation_log"]
+            if config.get("instrumentation_overlay"):
+                self.instrumentation_overlay = config["instrumentation_overlay"]
+            if config.get("instrumentation_interval_ms"):
+                self.instrumentation_interval_ms = config["instrumentation_interval_ms"]
+            if "startup_report" in config:
+                self.startup_report = config["startup_report"]
+            if "prefetch_tracks" in config:
+                self.prefetch_tracks = config["prefetch_tracks"]
+            if config.get("prefetch_processes"):
+                self.prefetch_processes = config["prefetch_processes"]
+            if "tempo_broadcast" in config:
+                self.tempo_broadcast = config["tempo_broadcast"]
+            if config.get("broadcast_group"):
+                self.broadcast_group = config["broadcast_group"]
+            if config.get("broadcast_port"):
+                self.broadcast_port = config["broadcast_port"]
+
+    def capture_device_name(self):
+        """Return name of the captured device to save as default device.
+
+        The selection can also be Automatic or a trace, which are not device
+        names. In automatic mode the loudest monitor is saved, and capturing
+        a monitor with monitor_all_sources starts in automatic mode again.
+        """
+        if isinstance(self.audio, AudioDevice) and self.audio.active:
+            return self.audio.active.device.deviceName()
+        return self.default_device_name
 
     @Slot()
     def save_config(self):
         fast_rhythm_algo = self.rhythm_algorithm == "degara"
         data = {
             "no_multiprocess": self.use_qt_thread,
+            "analysis_threads": self.analysis_threads,
             "rhythm_algorithm_faster": fast_rhythm_algo,
-            "default_device": self.audio_selection.currentText(),
+            "rhythm_algorithm": self.rhythm_algorithm,
+            "analysis_interval_ms": self.analysis_interval_ms,
+            "analysis_sample_rate": self.analysis_sample_rate,
+            "silence_gate": self.silence_gate,
+            "silence_threshold_db": self.silence_threshold_db,
+            "default_device": self.capture_device_name(),
+            "monitor_all_sources": self.monitor_all_sources,
+            "record_trace": self.record_trace,
+            "replay_trace": self.replay_trace,
             "show_video_preview": self.show_video_preview,
             "video_loop_bpm": self.video_loop_bpm,
             "video_update_skip_time_ms": self.video_update_skip_ms,
+            "video_renderer": self.video_renderer,
+            "frame_loop_height": self.frame_loop_height,
+            "frame_loop_frame_rates": self.frame_loop_frame_rates,
+            "max_frames_per_second": self.max_frames_per_second,
+            "beat_phase_lock": self.beat_phase_lock,
+            "video_beat_offset_ms": self.video_beat_offset_ms,
+            "phase_lock_interval_ms": self.phase_lock_interval_ms,
             "limit_tempo_by_default": self.limit_checkbox.isChecked(),
             "tempo_lower_limit": self.tempo_lower_limit,
             "tempo_upper_limit": self.tempo_upper_limit,
-            "screen": self.screen
+            "screen": self.screen,
+            "tempo_cache_file": self.tempo_cache_file,
+            "verification_interval_ms": self.verification_interval_ms,
+            "adaptive_analysis": self.adaptive_analysis,
+            "provisional_tempo": self.provisional_tempo,
+            "max_analysis_interval_ms": self.max_analysis_interval_ms,
+            "fast_analysis_interval_ms": self.fast_analysis_interval_ms,
+            "instrumentation": self.instrumentation,
+            "instrumentation_log": self.instrumentation_log,
+            "instrumentation_overlay": self.instrumentation_overlay,
+            "instrumentation_interval_ms": self.instrumentation_interval_ms,
+            "startup_report": self.startup_report,
+            "prefetch_tracks": self.prefetch_tracks,
+            "prefetch_processes": self.prefetch_processes,
+            "tempo_broadcast": self.tempo_broadcast,
+            "broadcast_group": self.broadcast_group,
+            "broadcast_port": self.broadcast_port
         }
         with open("config.JSON", "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=4)
-
-def get_spotify_track():
-    session_bus = pydbus.SessionBus()
-    try:
-        spotify_base = "/org/mpris/MediaPlayer2"
-        spotify = session_bus.get("org.mpris.MediaPlayer2.spotify", spotify_base)
-        return spotify["org.mpris.MediaPlayer2.Player"].Metadata["mpris:trackid"]
-    except gi.repository.GLib.Error as err:
-        spotify_not_running = (
-            "g-dbus-error-quark: "
-            "GDBus.Error:org.freedesktop.DBus.Error.ServiceUnknown: "
-            "The name org.mpris.MediaPlayer2.spotify "
-            "was not provided by any .service files (2)")
-        spotify_has_quit = (
-            "g-dbus-error-quark: "
-            "GDBus.Error:org.freedesktop.DBus.Error.NoReply: "
-            "Message recipient disconnected from message bus without replying (4)"
-        )
-        if str(err) == spotify_not_running:
-            return ""
-        if str(err) == spotify_has_quit:
-            return ""
-        raise
@@ -0,0 +1,12 @@
+"""Full screen capable widget for QMediaPlayer.
+
+Kept in its own module, so that QtMultimediaWidgets is only imported when
+the video is played with QMediaPlayer.
+"""
+from PySide2.QtCore import Signal
+from PySide2.QtMultimediaWidgets import QVideoWidget
+
+from video_widgets import FullscreenVideo
+
+class VideoWidget(FullscreenVideo, QVideoWidget):
+    fullscreen_changed = Signal(bool)
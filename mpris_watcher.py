@@ -0,0 +1,219 @@
+"""Non-blocking tracking of the currently playing track of MPRIS players."""
+import re
+import threading
+
+from PySide2.QtCore import QObject, Signal
+
+NO_TRACK = "/org/mpris/MediaPlayer2/TrackList/NoTrack"
+
+def track_key(player, metadata):
+    """Return key identifying a track of a player, empty if unknown.
+
+    Some players reuse track ids for different tracks, for example ids based
+    on the playlist position, so the track id is combined with the player and
+    the URL of the track, or its title if there is no URL.
+    """
+    track_id = str(metadata.get("mpris:trackid", ""))
+    if not track_id or track_id == NO_TRACK:
+        return ""
+    # Instance suffix, for example of VLC, changes every time it starts
+    player = re.sub(r"\.instance\d+$", "", player)
+    location = str(metadata.get("xesam:url", "")
+                   or metadata.get("xesam:title", ""))
+    return "|".join((player, track_id, location))
+
+class MprisWatcher(QObject):
+    """Keep track of the current track of all MPRIS media players.
+
+    A background thread with its own GLib main loop subscribes to
+    PropertiesChanged signals of all org.mpris.MediaPlayer2.* players and to
+    NameOwnerChanged for players starting and quitting. The active player is
+    the one which started playing most recently. Its track id and metadata are
+    cached, so reading them never blocks, even if a player is slow or hung.
+    D-Bus libraries are imported in the background thread too, so they do not
+    slow down start up.
+
+    If upcoming_count is above zero, the URL of the current track and of the
+    next upcoming_count tracks of the TrackList interface of the active player
+    are read whenever the track or the track list changes. Players without a
+    track list only give the current track.
+
+    Emits:
+        track_changed(str): track_key of the track of the active player,
+            empty if none or if the track can not be identified.
+        upcoming_tracks(list): (track_key, xesam:url) of the current and
+            upcoming tracks of the active player.
+    """
+    track_changed = Signal(str)
+    upcoming_tracks = Signal(object)
+
+    mpris_prefix = "org.mpris.MediaPlayer2."
+    mpris_path = "/org/mpris/MediaPlayer2"
+    player_interface = "org.mpris.MediaPlayer2.Player"
+    track_list_interface = "org.mpris.MediaPlayer2.TrackList"
+
+    def __init__(self, upcoming_count=0):
+        super().__init__()
+        self.upcoming_count = upcoming_count
+        self._players = {}
+        self._owners = {}
+        self._active = ""
+        self._track_id = ""
+        self._track_key = ""
+        self._identity = None
+        self._metadata = {}
+        self._loop = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def track_id(self):
+        return self._track_id
+
+    @property
+    def track_key(self):
+        return self._track_key
+
+    @property
+    def metadata(self):
+        return self._metadata
+
+    @property
+    def player(self):
+        """Bus name of the active player."""
+        return self._active
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        if self._loop:
+            self._loop.quit()
+
+    def _run(self):
+        import pydbus
+        from gi.repository import GLib
+
+        context = GLib.MainContext()
+        context.push_thread_default()
+        self._loop = GLib.MainLoop(context)
+        try:
+            self._bus = pydbus.SessionBus()
+            self._bus.subscribe(iface="org.freedesktop.DBus.Properties",
+                                signal="PropertiesChanged",
+                                object=self.mpris_path,
+                                signal_fired=self._properties_changed)
+            self._bus.subscribe(sender="org.freedesktop.DBus",
+                                iface="org.freedesktop.DBus",
+                                signal="NameOwnerChanged",
+                                signal_fired=self._name_owner_changed)
+            if self.upcoming_count > 0:
+                self._bus.subscribe(iface=self.track_list_interface,
+                                    object=self.mpris_path,
+                                    signal_fired=self._track_list_changed)
+            dbus = self._bus.get(".DBus")
+            for name in dbus.ListNames():
+                if name.startswith(self.mpris_prefix):
+                    self._add_player(name, dbus.GetNameOwner(name))
+        except GLib.Error as err:
+            print("MPRIS watcher not available:", err)
+            return
+        self._loop.run()
+
+    def _add_player(self, name, owner):
+        """Read initial state of a player."""
+        from gi.repository import GLib
+
+        self._owners[owner] = name
+        state = {"status": "Stopped", "metadata": {}, "order": 0}
+        self._players[name] = state
+        try:
+            player = self._bus.get(name, self.mpris_path)[self.player_interface]
+            state["status"] = player.PlaybackStatus
+            state["metadata"] = player.Metadata
+        except (GLib.Error, KeyError, AttributeError):
+            pass
+        if state["status"] == "Playing":
+            state["order"] = self._next_order()
+        self._select_active()
+
+    def _name_owner_changed(self, sender, obj, iface, signal, params):
+        name, old_owner, new_owner = params
+        if not name.startswith(self.mpris_prefix):
+            return
+        if old_owner:
+            self._owners.pop(old_owner, None)
+            self._players.pop(name, None)
+        if new_owner:
+            self._add_player(name, new_owner)
+        else:
+            self._select_active()
+
+    def _properties_changed(self, sender, obj, iface, signal, params):
+        interface, changed, _ = params
+        name = self._owners.get(sender)
+        if interface != self.player_interface or name not in self._players:
+            return
+        state = self._players[name]
+        if "Metadata" in changed:
+            state["metadata"] = changed["Metadata"]
+        if "PlaybackStatus" in changed:
+            status = changed["PlaybackStatus"]
+            if status == "Playing" and state["status"] != "Playing":
+                state["order"] = self._next_order()
+            state["status"] = status
+        self._select_active()
+
+    def _track_list_changed(self, sender, obj, iface, signal, params):
+        if self._owners.get(sender) == self._active and self._active:
+            self._read_upcoming()
+
+    def _next_order(self):
+        return max([x["order"] for x in self._players.values()] + [0]) + 1
+
+    def _select_active(self):
+        """Choose the latest player to start playing and update the cache."""
+        active = self._active if self._active in self._players else ""
+        playing = [(state["order"], name)
+                   for name, state in self._players.items()
+                   if state["status"] == "Playing"]
+        if playing:
+            active = max(playing)[1]
+
+        metadata = self._players[active]["metadata"] if active else {}
+        track_id = str(metadata.get("mpris:trackid", ""))
+        self._active = active
+        self._metadata = metadata
+        # The track id alone does not change between tracks of some players
+        identity = (active, track_id, str(metadata.get("xesam:url", "")),
+                    str(metadata.get("xesam:title", "")))
+        if identity != self._identity:
+            self._identity = identity
+            self._track_id = track_id
+            self._track_key = track_key(active, metadata)
+            self.track_changed.emit(self._track_key)
+            if self.upcoming_count > 0:
+                self._read_upcoming()
+
+    def _read_upcoming(self):
+        """Emit URLs of the current and next tracks of the active player."""
+        from gi.repository import GLib
+
+        tracks = [(self._track_key,
+                   str(self._metadata.get("xesam:url", "")))]
+        if self._active and self._track_key:
+            try:
+                proxy = self._bus.get(self._active, self.mpris_path)
+                track_list = proxy[self.track_list_interface]
+                ids = list(track_list.Tracks)
+                if self._track_id in ids:
+                    start = ids.index(self._track_id) + 1
+                    upcoming = ids[start:start + self.upcoming_count]
+                    if upcoming:
+                        for metadata in track_list.GetTracksMetadata(upcoming):
+                            tracks.append(
+                                (track_key(self._active, metadata),
+                                 str(metadata.get("xesam:url", ""))))
+            except (GLib.Error, KeyError, AttributeError):
+                # Player has no track list
+                pass
+        self.upcoming_tracks.emit([x for x in tracks if x[0] and x[1]])
@@ -0,0 +1,149 @@
+"""Lightweight tempo estimation using only NumPy."""
+import numpy as np
+
+from tempo_result import TempoResult, no_tempo
+
+ENVELOPE_RATE = 250.0
+_SMOOTHING = np.hanning(7)[1:-1] / np.hanning(7)[1:-1].sum()
+
+def onset_strength(audio, hop_size):
+    """Return smoothed onset strength of audio, one value for each hop.
+
+    Onset strength is the half-wave rectified difference of the log energy
+    envelope. Value i is the change from hop i to hop i + 1.
+    """
+    frame_count = len(audio) // hop_size
+    frames = np.reshape(audio[:frame_count * hop_size],
+                        (frame_count, hop_size))
+    envelope = np.log1p(1000.0 * np.einsum("ij,ij->i", frames, frames)
+                        / hop_size)
+    return np.convolve(np.maximum(np.diff(envelope), 0.0), _SMOOTHING,
+                       mode="same")
+
+def octave_evidence(audio, sample_rate, beats):
+    """Return beat strength evidence for the double and half tempo.
+
+    beats are beat positions in seconds relative to the end of audio. Returns
+    (double, half), both between 0 and 1. double is the onset strength
+    halfway between beats relative to the strength on the beats, which is
+    high when the double tempo is heard too. half is how much weaker every
+    other beat is than the rest, which is high when only every other beat is
+    a beat of the music. Returns () if there are too few beats.
+    """
+    hop_size = max(int(round(sample_rate / ENVELOPE_RATE)), 1)
+    rate = sample_rate / hop_size
+    onsets = onset_strength(audio, hop_size)
+    duration = len(audio) / sample_rate
+    beats = np.array([x for x in beats if -duration < x < 0.0])
+    if len(beats) < 4 or not len(onsets):
+        return ()
+
+    def strength(times):
+        # Strongest onset within two hops, as beat times are not exact
+        index = np.round((times + duration) * rate - 1.5).astype(int)
+        near = np.clip(index[:, None] + np.arange(-2, 3), 0, len(onsets) - 1)
+        return onsets[near].max(axis=1)
+
+    on_beats = strength(beats)
+    between = strength((beats[:-1] + beats[1:]) / 2.0)
+    if on_beats.mean() <= 0.0:
+        return ()
+    double = min(between.mean() / on_beats.mean(), 1.0)
+    even, odd = on_beats[::2].mean(), on_beats[1::2].mean()
+    half = 1.0 - min(even, odd) / max(even, odd)
+    return (float(double), float(half))
+
+class NumpyTempo():
+    """Estimate tempo from an energy envelope with FFT autocorrelation.
+
+    Audio is reduced to a log energy envelope at envelope_rate and the onset
+    strength (half-wave rectified envelope difference) is smoothed and
+    autocorrelated with FFT. Smoothing keeps sharp onsets from splitting their
+    autocorrelation peak between two lags. Each candidate beat period within
+    min_tempo and max_tempo is scored with a comb of its first harmonics,
+    weighted slightly towards 120 BPM to reduce octave errors. The best period
+    is refined with parabolic interpolation.
+
+    Confidence is the normalized autocorrelation at the beat period, between
+    0 (no periodicity) and 1 (perfectly periodic onsets). Beat phase is found
+    by folding the onset strength at the beat period.
+
+    A 7 second window takes a few milliseconds to analyse, which makes this
+    usable on computers where RhythmExtractor2013 can not keep up.
+    """
+    envelope_rate = ENVELOPE_RATE
+    confidence_limit = 0.15
+    _harmonic_weights = (1.0, 0.5, 0.25)
+
+    def __init__(self, sample_rate=44100, min_tempo=40, max_tempo=150):
+        self.sample_rate = sample_rate
+        self.hop_size = max(int(round(sample_rate / self.envelope_rate)), 1)
+        self.rate = sample_rate / self.hop_size
+
+        self.min_lag = int(np.floor(60.0 * self.rate / max_tempo))
+        self.max_lag = int(np.ceil(60.0 * self.rate / min_tempo))
+        self._lags = np.arange(self.min_lag, self.max_lag + 1)
+        self._tempo_weights = np.exp(
+            -0.5 * np.log2(60.0 * self.rate / self._lags / 120.0) ** 2)
+
+    def estimate(self, audio):
+        """Return TempoResult of audio. bpm is -1 if not found."""
+        frame_count = len(audio) // self.hop_size
+        if frame_count < 2 * self.max_lag:
+            return no_tempo()
+
+        onsets = onset_strength(audio, self.hop_size)
+        onsets -= onsets.mean()
+
+        fft_size = 1 << int(np.ceil(np.log2(2 * len(onsets))))
+        spectrum = np.fft.rfft(onsets, fft_size)
+        autocorrelation = np.fft.irfft(spectrum * np.conj(spectrum))
+        if autocorrelation[0] <= 0.0:
+            return no_tempo()
+        autocorrelation = autocorrelation[:len(onsets)] / autocorrelation[0]
+
+        padded = np.zeros(len(self._harmonic_weights) * (self.max_lag + 1))
+        usable = min(len(padded), len(autocorrelation))
+        padded[:usable] = autocorrelation[:usable]
+        scores = np.zeros(len(self._lags))
+        for harmonic, weight in enumerate(self._harmonic_weights, start=1):
+            scores += weight * padded[harmonic * self._lags]
+        scores *= self._tempo_weights
+
+        best = int(np.argmax(scores))
+        lag = float(self._lags[best])
+        if 0 < best < len(scores) - 1:
+            left, centre, right = scores[best - 1:best + 2]
+            divisor = left - 2.0 * centre + right
+            if divisor < 0.0:
+                lag += 0.5 * (left - right) / divisor
+
+        confidence = float(max(padded[self._lags[best]], 0.0))
+        beats = self._beats(onsets, lag, frame_count)
+        return TempoResult(float(60.0 * self.rate / lag), confidence, beats)
+
+    def _beats(self, onsets, lag, frame_count):
+        """Return beat positions relative to end of audio in seconds."""
+        bins = int(lag)
+        phases = (np.arange(len(onsets)) % lag).astype(int) % bins
+        folded = np.bincount(phases, weights=onsets, minlength=bins)
+        # Onset strength index i is the change from envelope frame i to i + 1
+        first = (np.argmax(folded) + 1.5) / self.rate
+        period = lag / self.rate
+        duration = frame_count / self.rate
+        return tuple(float(x) - duration
+                     for x in np.arange(first, duration, period))
+
+    def reset(self):
+        """Nothing to forget, every window is analysed on its own."""
+
+    def analyse(self, audio):
+        """Return TempoResult of audio with bpm -1 if not found reliably."""
+        result = self.estimate(audio)
+        if result.confidence > self.confidence_limit:
+            return result
+        return no_tempo(result.confidence)
+
+    def analyse_ring_buffer(self, ring_buffer, end, window_size):
+        """Return TempoResult of window_size samples ending at end."""
+        return self.analyse(ring_buffer.window(window_size, end))
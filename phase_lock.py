@@ -0,0 +1,94 @@
+"""Lock the nods of the video loop to the phase of detected beats."""
+import math
+
+class BeatPhaseLock():
+    """Predict beats from analysed beat ticks and correct video phase.
+
+    The beat grid is kept as the time of one beat and a beat period. Beat
+    ticks of each analysis are converted to monotonic time with the capture
+    time of the analysed window, and their circular mean phase is blended
+    into the grid with gain, so single inaccurate windows only nudge the grid.
+
+    The phase of the video is compared to the grid, and a small relative
+    playback rate correction is returned which removes the phase error over
+    horizon_s seconds. Corrections are quantized so that the playback rate is
+    not changed constantly, and no correction is made within tolerance_ms of
+    the beat. Nods of the video can be on every beat, every other beat or
+    twice per beat, so the phase error is taken modulo the shorter of the nod
+    and beat periods.
+    """
+    gain = 0.5
+    horizon_s = 2.0
+    max_correction = 0.1
+    correction_step = 0.005
+    tolerance_ms = 15.0
+    max_age_s = 30.0
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.beat_ns = None
+        self.period_ns = None
+        self.updated_ns = 0
+
+    @property
+    def locked(self):
+        return self.beat_ns is not None
+
+    def update(self, result):
+        """Update beat grid from TempoResult with capture timestamp."""
+        if result.bpm <= 0 or not result.beats or not result.timestamp_ns:
+            return
+        period_ns = 60e9 / result.bpm
+        reference_ns = result.timestamp_ns
+        x = y = 0.0
+        for beat in result.beats:
+            angle = 2.0 * math.pi * beat * 1e9 / period_ns
+            x += math.cos(angle)
+            y += math.sin(angle)
+        beat_ns = reference_ns + math.atan2(y, x) / (2.0 * math.pi) * period_ns
+
+        if self.locked and math.isclose(period_ns, self.period_ns,
+                                        rel_tol=0.03):
+            error = self._wrap(beat_ns - self.predict(beat_ns), period_ns)
+            beat_ns = self.predict(beat_ns) + self.gain * error
+            period_ns = self.period_ns + self.gain * (period_ns - self.period_ns)
+        self.beat_ns = beat_ns
+        self.period_ns = period_ns
+        self.updated_ns = reference_ns
+
+    def predict(self, time_ns):
+        """Return time of the beat nearest to time_ns."""
+        beats = round((time_ns - self.beat_ns) / self.period_ns)
+        return self.beat_ns + beats * self.period_ns
+
+    def correction(self, now_ns, video_position_ms, playback_rate,
+                   nod_period_ms, nod_offset_ms=0.0):
+        """Return relative playback rate correction, or None if not locked.
+
+        Parameters:
+            now_ns (int): Current monotonic time.
+            video_position_ms (int): Current position of the video.
+            playback_rate (float): Playback rate without correction.
+            nod_period_ms (float): Length of one nod in the video.
+            nod_offset_ms (float): Position of the beat within a nod.
+        """
+        if not self.locked or now_ns - self.updated_ns > self.max_age_s * 1e9:
+            return None
+        since_nod_ms = (video_position_ms - nod_offset_ms) % nod_period_ms
+        nod_ns = now_ns - since_nod_ms / playback_rate * 1e6
+        period_ns = min(nod_period_ms / playback_rate * 1e6, self.period_ns)
+        error_ns = self._wrap(nod_ns - self.predict(nod_ns), period_ns)
+        if abs(error_ns) < self.tolerance_ms * 1e6:
+            return 1.0
+        correction = error_ns / (self.horizon_s * 1e9)
+        correction = max(-self.max_correction,
+                         min(self.max_correction, correction))
+        return 1.0 + round(correction / self.correction_step) \
+            * self.correction_step
+
+    @staticmethod
+    def _wrap(value, period):
+        """Wrap value to [-period / 2, period / 2)."""
+        return (value + period / 2.0) % period - period / 2.0
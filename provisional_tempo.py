@@ -0,0 +1,72 @@
+"""Quick provisional tempo from short audio windows."""
+from PySide2.QtCore import QObject, Slot
+
+from instrumentation import metrics
+from numpy_tempo import NumpyTempo
+
+class ProvisionalTempo(QObject):
+    """Estimate tempo of short windows until the full analysis has a result.
+
+    After start(), for example on a track change, each new window_seconds of
+    audio captured after start is analysed with NumpyTempo in the calling
+    thread, which takes a few milliseconds. Results are passed to
+    bpm_set_fun tagged with tier "provisional". Analysis stops at confirm(),
+    when the full analysis of the long window has given a tempo.
+
+    Short windows only hold a few beats, so tempos below min_tempo are not
+    searched and found as their double instead.
+
+    Parameters:
+        bpm_set_fun: Called with (bpm, TempoResult) for each tempo found.
+        ring_buffer (RingBuffer): Buffer holding the audio data.
+    """
+    window_seconds = 2.0
+    min_tempo = 60
+    max_tempo = 150
+
+    def __init__(self, bpm_set_fun, ring_buffer):
+        super().__init__()
+        self.bpm_set_fun = bpm_set_fun
+        self.ring_buffer = ring_buffer
+        self.analyser = None
+        self.active = False
+        self.window_size = 0
+        self._start_index = 0
+        self.start()
+
+    def set_ring_buffer(self, ring_buffer):
+        self.ring_buffer = ring_buffer
+        self.start()
+
+    @Slot()
+    def start(self):
+        """Find provisional tempo of audio captured from now on."""
+        if self.analyser is None \
+                or self.analyser.sample_rate != self.ring_buffer.sample_rate:
+            self.analyser = NumpyTempo(self.ring_buffer.sample_rate,
+                                       self.min_tempo, self.max_tempo)
+            # At least two of the longest beat periods are needed
+            self.window_size = max(
+                int(self.window_seconds * self.ring_buffer.sample_rate),
+                (2 * self.analyser.max_lag + 1) * self.analyser.hop_size)
+        self.active = True
+        self._start_index = self.ring_buffer.write_index
+
+    def confirm(self):
+        """Stop, the full analysis has found the tempo."""
+        self.active = False
+
+    @Slot(int)
+    def audio_ready(self, end):
+        if not self.active:
+            return
+        if end - self._start_index < self.window_size:
+            return
+        start = metrics.now()
+        result = self.analyser.analyse_ring_buffer(self.ring_buffer, end,
+                                                   self.window_size)
+        metrics.record("provisional_analysis", start)
+        if result.bpm > 0:
+            self.bpm_set_fun(result.bpm, result._replace(
+                timestamp_ns=self.ring_buffer.write_time_ns,
+                tier="provisional"))
@@ -0,0 +1,134 @@
+"""Shared memory ring buffer for captured audio."""
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+class RingBuffer():
+    """Preallocated float32 ring buffer backed by shared memory.
+
+    Every sample is written twice, at position i and i + capacity, so any
+    window of at most capacity samples is a contiguous slice of the buffer and
+    can be handed to the analysers without copying.
+
+    The write index (total number of samples written), the sample rate and the
+    monotonic time of the latest write are stored in a small header in the
+    same shared memory block. A ring buffer attached by name from another
+    process therefore sees the same state. Each reader keeps its own read
+    index.
+
+    Parameters:
+        capacity (int): Number of samples kept in the buffer.
+        sample_rate (int): Sample rate of the stored audio.
+        name (str): Name of an existing shared memory block to attach to.
+                    A new block is created if not given.
+    """
+    _header_length = 3
+
+    def __init__(self, capacity, sample_rate=44100, name=None):
+        self.capacity = capacity
+        header_bytes = self._header_length * np.dtype(np.int64).itemsize
+        data_bytes = 2 * capacity * np.dtype(np.float32).itemsize
+
+        self._owner = name is None
+        if self._owner:
+            self._shm = shared_memory.SharedMemory(
+                create=True, size=header_bytes + data_bytes)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+
+        self._header = np.ndarray((self._header_length,), dtype=np.int64,
+                                  buffer=self._shm.buf)
+        self._data = np.ndarray((2 * capacity,), dtype=np.float32,
+                                buffer=self._shm.buf, offset=header_bytes)
+        if self._owner:
+            self._header[:] = (0, sample_rate, 0)
+            self._data[:] = 0.0
+
+        self.read_index = self.write_index
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def write_index(self):
+        return int(self._header[0])
+
+    @property
+    def sample_rate(self):
+        return int(self._header[1])
+
+    @sample_rate.setter
+    def sample_rate(self, value):
+        self._header[1] = value
+
+    @property
+    def write_time_ns(self):
+        """Monotonic time of the latest write, taken as capture time."""
+        return int(self._header[2])
+
+    @property
+    def new_samples(self):
+        """Number of samples written since the last read."""
+        return self.write_index - self.read_index
+
+    def write(self, samples, offset=0.0, scale=1.0):
+        """Write samples to the buffer as float32 (samples - offset) * scale.
+
+        Conversion is done directly into the buffer, so no temporary arrays are
+        created. Only the last capacity samples are stored if more is given.
+        """
+        total = len(samples)
+        if total > self.capacity:
+            samples = samples[-self.capacity:]
+        position = (self.write_index + total - len(samples)) % self.capacity
+
+        done = 0
+        while done < len(samples):
+            count = min(len(samples) - done, self.capacity - position)
+            target = self._data[position:position + count]
+            np.subtract(samples[done:done + count], offset,
+                        out=target, casting="unsafe")
+            if scale != 1.0:
+                target *= scale
+            self._data[position + self.capacity:
+                       position + self.capacity + count] = target
+            done += count
+            position = 0
+
+        self._header[0] += total
+        self._header[2] = time.monotonic_ns()
+
+    def window(self, size, end=None):
+        """Return a view of size samples ending at write index end.
+
+        Returns fewer samples if not enough data has been written yet.
+        """
+        if end is None:
+            end = self.write_index
+        size = min(size, end, self.capacity)
+        start = (end - size) % self.capacity
+        return self._data[start:start + size]
+
+    def read(self, size):
+        """Return a view of the newest size samples and update read index."""
+        end = self.write_index
+        self.read_index = end
+        return self.window(size, end)
+
+    def overwritten(self, size, end):
+        """Check if part of the window has already been overwritten."""
+        return self.write_index - (end - size) > self.capacity
+
+    def close(self):
+        """Release the shared memory. The creator also removes the block."""
+        self._header = None
+        self._data = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # Views of the buffer are still in use somewhere
+            pass
+        if self._owner:
+            self._shm.unlink()
@@ -0,0 +1,118 @@
+"""Incremental tempo estimation from a rolling onset detection function."""
+import numpy as np
+
+from tempo_result import TempoResult, no_tempo
+
+class StreamingTempo():
+    """Estimate tempo from only the audio which arrived since the last update.
+
+    New audio is split into frames and reduced to a spectral flux onset
+    detection function (ODF). The ODF values are kept in a rolling history of
+    history_seconds and tempo is estimated from the history with
+    TempoTapDegara, the same beat tracker which RhythmExtractor2013 uses with
+    the degara method. Each update therefore only does the spectral analysis
+    for new audio, and updates can be run much more often than a full
+    RhythmExtractor2013 analysis.
+
+    Hop size is scaled with sample rate so that the ODF rate is always the
+    44100/512 Hz which TempoTapDegara expects.
+
+    Confidence is the share of beat intervals close to the median interval.
+    """
+    odf_rate = 44100.0 / 512.0
+    min_history_seconds = 3.0
+
+    def __init__(self, sample_rate=44100, history_seconds=7.0,
+                 min_tempo=40, max_tempo=150):
+        self.sample_rate = sample_rate
+        self.hop_size = int(round(sample_rate / self.odf_rate))
+        self.frame_size = 2 * self.hop_size
+        self._window = np.hanning(self.frame_size).astype(np.float32)
+        self._history = np.zeros(int(history_seconds * self.odf_rate),
+                                 dtype=np.float32)
+        self._min_frames = int(self.min_history_seconds * self.odf_rate)
+        # Imported only when needed, importing essentia takes about a second
+        import essentia.standard
+        self._tempo_tap = essentia.standard.TempoTapDegara(
+            minTempo=min_tempo, maxTempo=max_tempo,
+            sampleRateODF=self.odf_rate)
+        self.reset()
+
+    def reset(self):
+        """Forget all earlier audio."""
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._previous_spectrum = None
+        self._history[:] = 0.0
+        self._frames = 0
+        self._last_end = None
+
+    def analyse_ring_buffer(self, ring_buffer, end, window_size):
+        """Update tempo with audio written to ring buffer since last call.
+
+        window_size is only used when there is no earlier audio, or when the
+        earlier audio has already been overwritten in the ring buffer.
+        """
+        if self._last_end is None or end - self._last_end > ring_buffer.capacity:
+            self.reset()
+            new_audio = ring_buffer.window(window_size, end)
+        else:
+            new_audio = ring_buffer.window(max(end - self._last_end, 0), end)
+        self._last_end = end
+        return self.update(new_audio)
+
+    def update(self, new_audio):
+        """Add new audio and return TempoResult of the rolling history."""
+        audio = np.concatenate((self._pending, new_audio))
+        frame_count = 0
+        if len(audio) >= self.frame_size:
+            frame_count = (len(audio) - self.frame_size) // self.hop_size + 1
+        if frame_count > 0:
+            frames = np.lib.stride_tricks.as_strided(
+                audio, shape=(frame_count, self.frame_size),
+                strides=(audio.strides[0] * self.hop_size, audio.strides[0]),
+                writeable=False)
+            self._add_odf(self._spectral_flux(frames))
+            self._pending = audio[frame_count * self.hop_size:]
+        else:
+            self._pending = audio
+
+        if self._frames < self._min_frames:
+            return no_tempo()
+        odf = self._history[-min(self._frames, len(self._history)):]
+        ticks = self._tempo_tap(np.ascontiguousarray(odf, dtype=np.float32))
+        if len(ticks) < 4:
+            return no_tempo()
+        # Beat tracking settles after the first beats, so tempo is taken from
+        # the latest two thirds. Average beat periods close to the median to
+        # get below ODF resolution.
+        periods = np.diff(ticks[len(ticks) // 3:])
+        median = np.median(periods)
+        consistent = periods[np.abs(periods - median) < 0.1 * median]
+        if not len(consistent):
+            return no_tempo()
+        # Ticks are at frame centres, hop_size after the frame start
+        history_end = (len(odf) / self.odf_rate
+                       + (len(self._pending) - self.hop_size) / self.sample_rate)
+        beats = tuple(float(x) - history_end for x in ticks)
+        return TempoResult(60.0 / float(np.mean(consistent)),
+                           len(consistent) / len(periods), beats)
+
+    def _spectral_flux(self, frames):
+        """Return half-wave rectified log spectral flux for each frame."""
+        spectra = np.log1p(
+            100.0 * np.abs(np.fft.rfft(frames * self._window, axis=1)))
+        if self._previous_spectrum is None:
+            self._previous_spectrum = spectra[0]
+        previous = np.vstack((self._previous_spectrum, spectra[:-1]))
+        self._previous_spectrum = spectra[-1]
+        return np.maximum(spectra - previous, 0.0).sum(axis=1)
+
+    def _add_odf(self, values):
+        """Append ODF values to the rolling history."""
+        count = len(values)
+        if count >= len(self._history):
+            self._history[:] = values[-len(self._history):]
+        else:
+            self._history[:-count] = self._history[count:]
+            self._history[-count:] = values
+        self._frames += count
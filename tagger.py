@@ -0,0 +1,98 @@
+"""Tag tempo of audio files in directory trees.
+
+Files are analysed in parallel with a process pool, each file streamed in
+chunks through the same decimation and rhythm analysers as live audio.
+Results are written as CSV, or as JSON if the output file ends with .json.
+
+Usage:
+    python tagger.py ~/Music --output tempo.csv
+    python tagger.py ~/Music ~/Mixes --method numpy --sample-rate 11025 \\
+        --output tempo.json
+"""
+import argparse
+import csv
+import json
+import multiprocessing as mp
+import os
+
+from file_source import analyse_file
+
+AUDIO_SUFFIXES = (".wav", ".flac", ".mp3", ".ogg", ".opus", ".m4a", ".aac",
+                  ".aiff", ".aif", ".wma", ".pcm", ".raw")
+FIELDS = ("path", "bpm", "confidence", "windows", "error")
+
+def find_audio_files(paths, suffixes=AUDIO_SUFFIXES):
+    """Return sorted audio files in paths and their subdirectories."""
+    files = []
+    for path in paths:
+        if os.path.isfile(path):
+            files.append(path)
+            continue
+        for root, _, names in os.walk(path):
+            files += [os.path.join(root, name) for name in names
+                      if name.lower().endswith(suffixes)]
+    return sorted(files)
+
+def tag_file(job):
+    """Analyse one file in a pool worker and return a result row.
+
+    Any error is recorded in the row, so one bad file does not stop the
+    batch.
+    """
+    path, method, sample_rate, interval_s = job
+    row = {"path": path, "bpm": None, "confidence": None, "windows": 0,
+           "error": ""}
+    try:
+        tempo = analyse_file(path, method, sample_rate, interval_s)
+    except Exception as err:
+        # For example essentia raises RuntimeError
+        row["error"] = "{}: {}".format(type(err).__name__, err)
+        return row
+    if tempo.bpm > 0:
+        row["bpm"] = round(tempo.bpm, 2)
+        row["confidence"] = round(tempo.confidence, 3)
+    row["windows"] = tempo.windows
+    return row
+
+def write_results(rows, path):
+    if path.lower().endswith(".json"):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=4)
+        return
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Analyse tempo of audio files in directory trees.")
+    parser.add_argument("paths", nargs="+",
+                        help="Audio files and directories to analyse.")
+    parser.add_argument("--output", required=True,
+                        help="CSV file, or JSON file if ending with .json.")
+    parser.add_argument("--method", default="multifeature",
+                        choices=("multifeature", "degara", "streaming",
+                                 "numpy"))
+    parser.add_argument("--sample-rate", type=int, default=44100,
+                        help="Analysis sample rate for streaming and numpy.")
+    parser.add_argument("--interval", type=float, default=3.0,
+                        help="Seconds of audio between analysis windows.")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(),
+                        help="Number of worker processes.")
+    args = parser.parse_args()
+
+    files = find_audio_files(args.paths)
+    jobs = [(path, args.method, args.sample_rate, args.interval)
+            for path in files]
+    rows = []
+    with mp.Pool(args.processes) as pool:
+        for row in pool.imap_unordered(tag_file, jobs):
+            rows.append(row)
+            print("{}/{} {} {}".format(len(rows), len(jobs), row["path"],
+                                       row["error"] or row["bpm"]))
+    rows.sort(key=lambda row: row["path"])
+    write_results(rows, args.output)
+
+if __name__ == "__main__":
+    main()
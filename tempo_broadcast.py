@@ -0,0 +1,103 @@
+"""Tempo estimates over local network UDP multicast.
+
+One computer analyses audio and sends each estimate as a JSON datagram to a
+multicast group, and any number of displays in the same network follow it
+without capturing or analysing audio themselves. The capture time is sent as
+wall clock time, so the beat positions line up on every display as long as
+their clocks are synchronised, for example with NTP.
+"""
+import json
+import time
+
+from PySide2.QtCore import QObject, Signal, Slot
+from PySide2.QtNetwork import QAbstractSocket, QHostAddress, QUdpSocket
+
+from tempo_result import TempoResult
+
+DEFAULT_GROUP = "239.255.42.99"
+DEFAULT_PORT = 5599
+
+def tempo_message(result):
+    """Return a JSON serialisable dict of a TempoResult."""
+    now = time.time()
+    capture_time = now
+    if result.timestamp_ns:
+        capture_time -= (time.monotonic_ns() - result.timestamp_ns) / 1e9
+    return {
+        "bpm": result.bpm,
+        "confidence": result.confidence,
+        "beats": list(result.beats),
+        "timestamp_ns": result.timestamp_ns,
+        "tier": result.tier,
+        "octave_evidence": list(result.octave_evidence),
+        "capture_time": capture_time,
+        "time": now,
+    }
+
+def tempo_from_message(message):
+    """Return TempoResult of a message with capture time on local clock."""
+    age_s = time.time() - message.get("capture_time", time.time())
+    return TempoResult(float(message["bpm"]),
+                       float(message.get("confidence", 0.0)),
+                       tuple(message.get("beats", ())),
+                       time.monotonic_ns() - int(age_s * 1e9),
+                       message.get("tier", "full"),
+                       tuple(message.get("octave_evidence", ())))
+
+class TempoBroadcaster(QObject):
+    """Send tempo estimates to a multicast group.
+
+    ttl 1 keeps the datagrams inside the local network.
+    """
+    def __init__(self, group=DEFAULT_GROUP, port=DEFAULT_PORT, ttl=1):
+        super().__init__()
+        self.group = QHostAddress(group)
+        self.port = port
+        self.socket = QUdpSocket(self)
+        self.socket.setSocketOption(QAbstractSocket.MulticastTtlOption, ttl)
+        # Followers on the same computer receive the datagrams too
+        self.socket.setSocketOption(QAbstractSocket.MulticastLoopbackOption, 1)
+
+    def publish(self, result):
+        data = json.dumps(tempo_message(result)).encode("utf-8")
+        if self.socket.writeDatagram(data, self.group, self.port) < 0:
+            print("Could not send tempo:", self.socket.errorString())
+
+    def close(self):
+        self.socket.close()
+
+class TempoFollower(QObject):
+    """Receive tempo estimates sent by a TempoBroadcaster.
+
+    Emits tempo with a TempoResult for each received estimate.
+    """
+    tempo = Signal(object)
+
+    def __init__(self, group=DEFAULT_GROUP, port=DEFAULT_PORT):
+        super().__init__()
+        self.group = QHostAddress(group)
+        self.socket = QUdpSocket(self)
+        # Several followers on the same computer can share the port
+        if not self.socket.bind(QHostAddress(QHostAddress.AnyIPv4), port,
+                                QUdpSocket.ShareAddress):
+            print("Could not listen on port", port, self.socket.errorString())
+        elif not self.socket.joinMulticastGroup(self.group):
+            print("Could not join multicast group", group + ":",
+                  self.socket.errorString())
+        self.socket.readyRead.connect(self.read_datagrams)
+
+    @Slot()
+    def read_datagrams(self):
+        while self.socket.hasPendingDatagrams():
+            data, _, _ = self.socket.readDatagram(
+                self.socket.pendingDatagramSize())
+            try:
+                result = tempo_from_message(json.loads(data.data()))
+            except (ValueError, KeyError, TypeError) as err:
+                print("Invalid tempo message:", err)
+                continue
+            self.tempo.emit(result)
+
+    def close(self):
+        self.socket.leaveMulticastGroup(self.group)
+        self.socket.close()
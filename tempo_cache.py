@@ -0,0 +1,104 @@
+"""Persistent cache of converged tempo for each track."""
+import math
+import sqlite3
+import time
+from collections import namedtuple
+
+import numpy as np
+
+CachedTempo = namedtuple("CachedTempo", ["bpm", "confidence", "octave"])
+
+class TempoCache():
+    """Store converged tempo of tracks in SQLite keyed by track.
+
+    Tracks are identified with mpris_watcher.track_key, which is stored in
+    the track_id column.
+
+    Each entry holds the tempo used for the video, the confidence of the
+    converged estimate and the half/double choice as octave, the power of two
+    between the used tempo and the analysed tempo. Least recently used
+    entries are removed when there are more than max_entries tracks.
+
+    Lookups are only reads. Their time of use is kept in memory and written
+    with the next put or on close, so a track change does not wait for disk.
+    """
+    def __init__(self, path, max_entries=10000):
+        self.max_entries = max_entries
+        self._used = {}
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS tempo ("
+            "track_id TEXT PRIMARY KEY, "
+            "bpm REAL NOT NULL, "
+            "confidence REAL NOT NULL, "
+            "octave INTEGER NOT NULL, "
+            "last_used REAL NOT NULL)")
+        self._connection.commit()
+
+    def get(self, track_id):
+        """Return CachedTempo for track or None if not found."""
+        row = self._connection.execute(
+            "SELECT bpm, confidence, octave FROM tempo WHERE track_id = ?",
+            (track_id,)).fetchone()
+        if row is None:
+            return None
+        self._used[track_id] = time.time()
+        return CachedTempo(*row)
+
+    def _write_used(self):
+        """Write times of use of looked up tracks, without committing."""
+        self._connection.executemany(
+            "UPDATE tempo SET last_used = ? WHERE track_id = ?",
+            [(used, track_id) for track_id, used in self._used.items()])
+        self._used = {}
+
+    def put(self, track_id, bpm, confidence, octave=0):
+        """Store tempo of track, evicting least recently used tracks."""
+        self._used.pop(track_id, None)
+        self._write_used()
+        self._connection.execute(
+            "INSERT OR REPLACE INTO tempo VALUES (?, ?, ?, ?, ?)",
+            (track_id, bpm, confidence, octave, time.time()))
+        self._connection.execute(
+            "DELETE FROM tempo WHERE track_id NOT IN ("
+            "SELECT track_id FROM tempo ORDER BY last_used DESC LIMIT ?)",
+            (self.max_entries,))
+        self._connection.commit()
+
+    def close(self):
+        if self._used:
+            self._write_used()
+            self._connection.commit()
+        self._connection.close()
+
+class TempoConvergence():
+    """Detect when tempo estimates of a track have converged.
+
+    Tempo has converged when required_estimates of the latest history_length
+    estimates agree within tolerance. Confidence is the share of the latest
+    estimates agreeing with the converged tempo.
+    """
+    required_estimates = 3
+    history_length = 5
+    tolerance = 0.03
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.estimates = []
+        self.confidence = 0.0
+
+    def add(self, bpm):
+        """Add estimate and return converged tempo, or None."""
+        self.estimates = (self.estimates + [bpm])[-self.history_length:]
+        estimates = np.array(self.estimates)
+        agreeing = estimates[np.abs(estimates - bpm) <= self.tolerance * bpm]
+        if len(agreeing) < self.required_estimates:
+            return None
+        self.confidence = len(agreeing) / len(estimates)
+        return float(np.median(agreeing))
+
+def octave_between(bpm, analysed_bpm):
+    """Return power of two between used and analysed tempo."""
+    return int(round(math.log2(bpm / analysed_bpm)))
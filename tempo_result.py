@@ -0,0 +1,26 @@
+"""Result of analysing the tempo of an audio window."""
+from collections import namedtuple
+
+TempoResult = namedtuple("TempoResult",
+                         ["bpm", "confidence", "beats", "timestamp_ns",
+                          "tier", "octave_evidence"],
+                         defaults=(0.0, (), 0, "full", ()))
+TempoResult.__doc__ = """Tempo of an audio window.
+
+Fields:
+    bpm (float): Tempo, -1 if not found reliably.
+    confidence (float): Confidence given by the rhythm algorithm. Scale
+                        depends on the algorithm.
+    beats (tuple): Beat positions in seconds relative to the end of the
+                   window, so all are negative.
+    timestamp_ns (int): Monotonic capture time of the end of the window, 0 if
+                        not known.
+    tier (str): "full" for the long analysis window, "provisional" for a
+                quick estimate of a short window.
+    octave_evidence (tuple): Beat strength evidence (double, half) for the
+                             double and half tempo, see
+                             numpy_tempo.octave_evidence. Empty if unknown.
+"""
+
+def no_tempo(confidence=0.0):
+    return TempoResult(-1, confidence)
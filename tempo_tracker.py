@@ -0,0 +1,112 @@
+"""Confidence weighted consensus of tempo estimates."""
+import math
+
+class TempoTracker():
+    """Decide the tempo to show from a history of analysed estimates.
+
+    Estimates are weighted by their confidence and by how recent they are.
+    Estimates which are the same tempo up to an octave (half, double) form a
+    cluster, and the cluster with the most weight is the current tempo.
+    The octave inside the cluster is chosen by the weight of estimates at
+    each octave together with beat strength evidence of the estimates: an
+    estimate adds beat_strength_weight times its weight times the onset
+    strength between its beats to the double tempo, and times how much
+    weaker every other beat is to the half tempo. The octave of the shown
+    tempo is kept unless another octave has clearly more weight, and if no
+    octave has, the one inside lower..upper is preferred.
+
+    A new tempo is committed only when its cluster has at least stability
+    share of the weight and it differs from the shown tempo by more than
+    min_change, so single wrong estimates and half/double flips do not
+    change the playback rate.
+    """
+    history_size = 8
+    decay = 0.8
+    tolerance = 0.04
+    stability = 0.6
+    min_change = 0.015
+    beat_strength_weight = 1.0
+
+    def __init__(self, lower=60.0, upper=120.0):
+        self.lower = lower
+        self.upper = upper
+        self.reset()
+
+    def reset(self, bpm=None):
+        """Forget estimates and optionally set the shown tempo."""
+        self.history = []
+        self.bpm = bpm
+
+    def add(self, bpm, confidence=0.0, evidence=()):
+        """Add estimate and return tempo to show, or None if unchanged.
+
+        evidence is (double, half) beat strength evidence of the estimate, see
+        TempoResult.octave_evidence, or empty if not known.
+        """
+        # Some methods have no confidence, then all estimates weigh the same
+        self.history.append((bpm, confidence if confidence > 0 else 1.0,
+                             tuple(evidence)))
+        del self.history[:-self.history_size]
+
+        weights = [weight * self.decay ** (len(self.history) - 1 - index)
+                   for index, (_, weight, _) in enumerate(self.history)]
+        total = sum(weights)
+
+        cluster = []
+        for center, _, _ in self.history:
+            members = [(tempo, weight, evidence)
+                       for (tempo, _, evidence), weight
+                       in zip(self.history, weights)
+                       if self._octave_distance(tempo, center)
+                       < math.log2(1.0 + self.tolerance)]
+            if sum(x[1] for x in members) > sum(x[1] for x in cluster):
+                cluster = members
+        cluster_weight = sum(x[1] for x in cluster)
+        if self.bpm is not None and cluster_weight < self.stability * total:
+            return None
+
+        tempo = self._choose_octave(cluster, cluster_weight)
+        if self.bpm is not None \
+                and abs(tempo - self.bpm) <= self.min_change * self.bpm:
+            return None
+        self.bpm = tempo
+        return tempo
+
+    def _choose_octave(self, cluster, cluster_weight):
+        """Return weighted mean tempo of cluster at the chosen octave."""
+        reference = cluster[0][0]
+        octaves = {}
+        for tempo, weight, evidence in cluster:
+            octave = round(math.log2(tempo / reference))
+            octaves[octave] = octaves.get(octave, 0.0) + weight
+            if evidence:
+                double, half = evidence
+                weight *= self.beat_strength_weight
+                octaves[octave + 1] = octaves.get(octave + 1, 0.0) \
+                    + weight * double
+                octaves[octave - 1] = octaves.get(octave - 1, 0.0) \
+                    + weight * half
+        ranked = sorted(octaves.items(), key=lambda x: x[1], reverse=True)
+        octave, weight = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+
+        # With two octaves, same as the best having less than stability share
+        if runner_up > weight * (1.0 - self.stability) / self.stability:
+            # No octave has clearly more weight
+            candidates = [x for x in octaves
+                          if self.lower <= reference * 2.0 ** x <= self.upper]
+            if self.bpm is not None and self._octave_distance(
+                    self.bpm, reference) < math.log2(1.0 + self.tolerance):
+                octave = round(math.log2(self.bpm / reference))
+            elif candidates:
+                octave = candidates[0]
+
+        folded = [(tempo * 2.0 ** (octave - round(math.log2(tempo / reference))),
+                   weight) for tempo, weight, _ in cluster]
+        return sum(tempo * weight for tempo, weight in folded) / cluster_weight
+
+    @staticmethod
+    def _octave_distance(first, second):
+        """Distance of tempos in octaves, ignoring whole octaves."""
+        distance = abs(math.log2(first / second)) % 1.0
+        return min(distance, 1.0 - distance)
@@ -0,0 +1,33 @@
+"""Tests of finding the number of nods in a looping clip.
+
+Usage:
+    python -m pytest test_build_loop.py
+"""
+import numpy as np
+import pytest
+
+from build_loop import count_nods
+
+def nodding_clip(frame_count, nods, noise=0.0):
+    """Return frames of a blob moving smoothly up and down nods times."""
+    rng = np.random.default_rng(0)
+    y = np.arange(64)[:, None]
+    x = np.arange(48)[None, :]
+    frames = []
+    for index in range(frame_count):
+        phase = 2.0 * np.pi * nods * index / frame_count
+        centre_y = 32.0 + 12.0 * np.sin(phase)
+        centre_x = 24.0 + 3.0 * np.cos(phase)
+        frame = 255.0 * np.exp(-((y - centre_y) ** 2 + (x - centre_x) ** 2)
+                               / (2.0 * 6.0 ** 2))
+        frames.append(frame + rng.normal(0.0, noise, frame.shape))
+    return np.array(frames, dtype=np.float32)
+
+@pytest.mark.parametrize("frame_count, nods", [
+    (90, 1), (75, 1), (60, 2), (90, 3), (96, 4), (120, 5), (64, 8)])
+@pytest.mark.parametrize("noise", [0.0, 5.0])
+def test_count_nods(frame_count, nods, noise):
+    assert count_nods(nodding_clip(frame_count, nods, noise)) == nods
+
+def test_still_clip_is_one_nod():
+    assert count_nods(np.zeros((30, 8, 8), dtype=np.float32)) == 1
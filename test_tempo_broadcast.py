@@ -0,0 +1,69 @@
+"""Tests of sending tempo estimates over UDP multicast.
+
+The loopback test needs a network interface which accepts multicast, for
+example lo with MulticastLoopbackOption.
+
+Usage:
+    python -m pytest test_tempo_broadcast.py
+"""
+import time
+
+import pytest
+
+from PySide2.QtCore import QCoreApplication, QEventLoop, QTimer
+from PySide2.QtNetwork import QAbstractSocket
+
+from tempo_broadcast import (DEFAULT_GROUP, TempoBroadcaster, TempoFollower,
+                             tempo_from_message, tempo_message)
+from tempo_result import TempoResult
+
+# Port other than DEFAULT_PORT, so a running follower is not disturbed
+TEST_PORT = 45599
+
+APP = QCoreApplication.instance() or QCoreApplication([])
+
+def example_result(age_ms=100):
+    return TempoResult(123.5, 0.75, (0.12, 0.61, 1.1),
+                       time.monotonic_ns() - int(age_ms * 1e6), "provisional",
+                       (0.25, 0.5))
+
+def test_message_round_trip():
+    result = example_result()
+    received = tempo_from_message(tempo_message(result))
+    assert received.bpm == result.bpm
+    assert received.confidence == result.confidence
+    assert received.beats == result.beats
+    assert received.tier == result.tier
+    assert received.octave_evidence == result.octave_evidence
+    assert abs(received.timestamp_ns - result.timestamp_ns) < 5e6
+
+def test_message_without_optional_fields():
+    received = tempo_from_message({"bpm": 90})
+    assert received.bpm == 90.0
+    assert received.beats == ()
+    assert received.tier == "full"
+    assert abs(received.timestamp_ns - time.monotonic_ns()) < 5e6
+
+def test_loopback():
+    follower = TempoFollower(DEFAULT_GROUP, TEST_PORT)
+    if follower.socket.state() != QAbstractSocket.BoundState:
+        pytest.skip("Can not listen on UDP port {}".format(TEST_PORT))
+    broadcaster = TempoBroadcaster(DEFAULT_GROUP, TEST_PORT)
+    received = []
+    loop = QEventLoop()
+    follower.tempo.connect(received.append)
+    follower.tempo.connect(loop.quit)
+    QTimer.singleShot(2000, loop.quit)
+
+    result = example_result()
+    broadcaster.publish(result)
+    loop.exec_()
+    broadcaster.close()
+    follower.close()
+
+    assert received, "No tempo received"
+    tempo = received[0]
+    assert tempo.bpm == result.bpm
+    assert tempo.beats == result.beats
+    assert tempo.tier == result.tier
+    assert abs(tempo.timestamp_ns - result.timestamp_ns) < 20e6
@@ -0,0 +1,91 @@
+"""Tempo analysis of upcoming tracks before they start playing."""
+import multiprocessing as mp
+import os
+from urllib.parse import unquote, urlparse
+
+from PySide2.QtCore import QObject, Signal, Slot
+
+from file_source import analyse_file
+
+def local_path(url):
+    """Return file path of a file:// URL, None for other URLs."""
+    parsed = urlparse(url)
+    if parsed.scheme != "file":
+        return None
+    return unquote(parsed.path)
+
+class TrackPrefetcher(QObject):
+    """Analyse audio files of the current and upcoming tracks in background.
+
+    Files are analysed with analyse_file in a pool of worker processes with
+    lowered scheduling priority, so the analysis does not disturb capture,
+    live analysis or video playback. Tempos found are stored in the tempo
+    cache with the track key, so the tempo of a track is usually known before
+    it starts and the live analysis only has to verify it. Tracks which are
+    already cached, or are not local files, are skipped.
+
+    Parameters:
+        tempo_cache (TempoCache): Cache to store tempos in.
+        method (str): Rhythm algorithm, as in live analysis.
+        sample_rate (int): Analysis sample rate.
+        processes (int): Number of worker processes.
+        niceness (int): Increment of worker process niceness.
+
+    Emits:
+        analysed(str): Track key whose tempo was stored in the cache.
+    """
+    analysed = Signal(str)
+    _finished = Signal(str, object)
+
+    def __init__(self, tempo_cache, method="multifeature", sample_rate=44100,
+                 processes=1, niceness=10):
+        super().__init__()
+        self.tempo_cache = tempo_cache
+        self.method = method
+        self.sample_rate = sample_rate
+        self.processes = max(processes, 1)
+        self.niceness = niceness
+        self.pool = None
+        self.pending = set()
+        self._finished.connect(self.store)
+
+    @Slot(object)
+    def prefetch(self, tracks):
+        """Analyse tracks, a list of (track key, URL), in the given order."""
+        for track_key, url in tracks:
+            path = local_path(url)
+            if not track_key or not path or track_key in self.pending:
+                continue
+            if self.tempo_cache.get(track_key) or not os.path.isfile(path):
+                continue
+            if self.pool is None:
+                # Threads are running by now, which makes forking unsafe
+                self.pool = mp.get_context("spawn").Pool(
+                    self.processes, initializer=os.nice,
+                    initargs=(self.niceness,))
+            self.pending.add(track_key)
+            # Callbacks run in a thread of the pool, signal passes them to
+            # the thread of this object
+            self.pool.apply_async(
+                analyse_file, (path, self.method, self.sample_rate),
+                callback=lambda result, track_key=track_key:
+                self._finished.emit(track_key, result),
+                error_callback=lambda err, track_key=track_key:
+                self._finished.emit(track_key, err))
+
+    @Slot(str, object)
+    def store(self, track_key, result):
+        self.pending.discard(track_key)
+        if isinstance(result, Exception):
+            print("Could not analyse upcoming track:", result)
+            return
+        if result.bpm <= 0:
+            return
+        if not self.tempo_cache.get(track_key):
+            self.tempo_cache.put(track_key, result.bpm, result.confidence, 0)
+        self.analysed.emit(track_key)
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
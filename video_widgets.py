@@ -0,0 +1,43 @@
+"""Video widgets which can be toggled to full screen."""
+from PySide2.QtCore import Qt, Signal
+from PySide2.QtGui import QPalette
+from PySide2.QtWidgets import QApplication
+
+from frame_loop import FrameLoopWidget
+
+class FullscreenVideo():
+    """Fullscreen toggling shared by the video widgets."""
+    def __init__(self, parent, show_preview, screen):
+        super().__init__(parent)
+        self.show_preview = show_preview
+        self.screen = screen
+
+        self.pal = self.palette()
+        self.pal.setColor(QPalette.Background, Qt.black)
+        self.setAutoFillBackground(True)
+        self.setPalette(self.pal)
+
+        self.desktop = QApplication.desktop()
+
+    def mouseDoubleClickEvent(self, event):
+        if self.isFullScreen():
+            if self.show_preview:
+                self.setFullScreen(False)
+            else:
+                self.hide()
+            self.fullscreen_changed.emit(False)
+        else:
+            self.setFullScreen(True)
+            self.setGeometry(self.desktop.screenGeometry(self.screen))
+            self.fullscreen_changed.emit(True)
+
+    def keyPressEvent(self, event):
+        if event.key() == Qt.Key_Escape:
+            if self.show_preview:
+                self.setFullScreen(False)
+            else:
+                self.hide()
+            self.fullscreen_changed.emit(False)
+
+class FrameVideoWidget(FullscreenVideo, FrameLoopWidget):
+    fullscreen_changed = Signal(bool)